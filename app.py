@@ -1,11 +1,28 @@
 import numpy as np
 import cv2
 import random
+import os
+import json
 
 # Frame options
 GAZE_TRACKING_ENABLED = True
 CALIBRATION_ENABLED = True
+FACE_TRACKING_ENABLED = True
+DETECTION_SCALE = 1  # Downscale factor used by the face detector (1, 2 or 4)
+PROFILE_PATH = "calibration_profile.json"  # Calibration saved between launches
+PROFILE_REFINE = True  # Refine a loaded profile in the background
+RECALIBRATION_INTERVAL = 30  # Frames between two threshold evaluations after calibration (0 to disable)
+RECALIBRATION_WINDOW = 100  # Number of evaluations averaged by the rolling recalibration
+RATIO_FILTER = "one_euro"  # Smoothing of the gaze ratios ("one_euro" or "exponential")
+GAZE_DECOUPLED = False  # Detect the gaze on its own worker, the video keeps the camera rate
+GAZE_DETECTION_RATE = 0  # Maximum gaze detections per second when decoupled (0 for as fast as possible)
+EXTRAPOLATE_GAZE = True  # Predict the gaze ratios of the frames between two detections when decoupled
 SHOW_TEXT_MESSAGE = True
+JPEG_QUALITY = 80
+ENCODER_THREADS = 2  # Frames encoded in parallel by the encode stage
+ADAPTIVE_QUALITY = True  # Lower the JPEG quality and resolution of the viewers that can't keep up
+TARGET_FPS = 15  # Frame rate kept for every viewer by the adaptive quality
+QUALITY_LEVELS = ((JPEG_QUALITY, 1.0), (65, 1.0), (50, 1.0), (50, 0.75), (40, 0.75), (40, 0.5))  # (quality, scale)
 SHOW_EYE_POSITIONS = False
 SHOW_GAZE_POSITION = False
 SHOW_CALIBRATION_POINTS = False
@@ -26,9 +43,19 @@ def configure_camera():
 ############################
 ## GAZETRACKING FUNCTIONS ##
 ############################
-from gaze_tracking import GazeTracking
+from gaze_tracking import GazeTracking, Calibration, StageTimer
+from gaze_tracking.filters import create_filter, LinearExtrapolator
+from streaming import Metrics, FrameGrabber, Broadcaster, EncodedFrame, ScreenCache, QualityController
+from streaming import Pipeline, Stage, Packet, Sampler
 
-gaze = GazeTracking()
+# The landmarks model is loaded in the background, raw frames are shown until it is ready
+gaze = GazeTracking(face_tracking=FACE_TRACKING_ENABLED, detection_scale=DETECTION_SCALE, timer=StageTimer(),
+                    background_loading=True,
+                    calibration=Calibration(RECALIBRATION_INTERVAL, RECALIBRATION_WINDOW))
+metrics = Metrics(timers=[gaze.timer])
+
+# Drains the camera in a background thread, keeping only the latest frame
+grabber = FrameGrabber(cap, metrics)
 
 # Gaze calibration
 center_point = (0.5, 0.5)
@@ -45,12 +72,10 @@ def calibrate_gaze():
         success, frame = cap.read()
         if success:
             try:
-                gaze.refresh(frame)
-                horiz_ratio = gaze.horizontal_ratio()
-                verti_ratio = gaze.vertical_ratio()
-                if (horiz_ratio is not None) and (verti_ratio is not None):
-                    horiz_ratio_sum += horiz_ratio
-                    verti_ratio_sum += verti_ratio
+                result = gaze.refresh(frame)
+                if result.pupils_located:
+                    horiz_ratio_sum += result.horizontal_ratio
+                    verti_ratio_sum += result.vertical_ratio
                     sample += 1
             except:
                 print("Gaze refresh error. Skipping frame.")
@@ -62,6 +87,58 @@ def calibrate_gaze():
     center_point = (horiz_ratio_center, verti_ratio_center)
 
 
+# Calibration profile
+def save_profile(path=PROFILE_PATH):
+    profile = {
+        "center_point": list(center_point),
+        "calibration": gaze.calibration.state(),
+        "ratio_filter": ratio_filter.state(),
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(profile, file, indent=2)
+    os.replace(temp_path, path)
+
+def load_profile(path=PROFILE_PATH):
+    global center_point
+    try:
+        with open(path) as file:
+            profile = json.load(file)
+        gaze.calibration.load_state(profile["calibration"])
+        center_point = tuple(profile["center_point"])
+        ratio_filter.load_state(profile.get("ratio_filter", center_point))
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    return True
+
+
+# Refine the center point of a loaded profile with the frames being processed
+refining = False
+refine_samples = []
+refine_tolerance = 0.1  # Ignore the refinement if the center point moved more than this
+def start_refining():
+    global refining, refine_samples
+    refine_samples = []
+    refining = True
+
+def refine_center(horiz_ratio, verti_ratio):
+    global refining, center_point
+    refine_samples.append((horiz_ratio, verti_ratio))
+    if len(refine_samples) < num_samples:
+        return
+
+    refining = False
+    # The median ignores the few samples taken while blinking or looking away
+    measured = np.median(refine_samples, axis=0)
+    if np.max(np.abs(measured - center_point)) > refine_tolerance:
+        # The viewer wasn't looking at the center: keep the saved profile
+        print("Center refinement too far from the profile. Ignoring it.")
+        return
+
+    center_point = (float(center_point[0] + measured[0]) / 2, float(center_point[1] + measured[1]) / 2)
+    save_profile()
+
+
 # Check if the user is looking at the center
 looking_down = False
 random_int = 0
@@ -76,22 +153,19 @@ def is_looking_down(verti_ratio):
         looking_down = True
     elif verti_delta < exit_threshold:
         looking_down = False
-    print(looking_down, int(verti_delta * 100))
+    metrics.set("looking_down", looking_down)
+    metrics.set("vertical_delta", verti_delta)
     return looking_down
 
-# Apply low pass filter to the ratio
-horiz_ratio_filtered = 0.5
-verti_ratio_filtered = 0.5
-filter_size = 3
-def apply_ratio_filter(horiz_ratio, verti_ratio):
-    global horiz_ratio_filtered, verti_ratio_filtered
-    horiz_ratio_filtered = (horiz_ratio_filtered * filter_size + horiz_ratio) / (filter_size + 1)
-    verti_ratio_filtered = (verti_ratio_filtered * filter_size + verti_ratio) / (filter_size + 1)
-    return horiz_ratio_filtered, verti_ratio_filtered
+# Low pass filter applied to the ratio ("one_euro" adapts its smoothing to the
+# speed of the gaze, "exponential" is a fixed average), tuned for the rate of the
+# ratios: the camera rate, or the rate of the gaze detection when decoupled
+ratio_rate = (GAZE_DETECTION_RATE or 8) if GAZE_DECOUPLED else 30
+ratio_filter = create_filter(RATIO_FILTER, ratio_rate)
 
 # Create a black frame
-def black_frame():
-    return np.zeros((image_height, image_width, 3), dtype=np.uint8)
+def black_frame(width=image_width, height=image_height):
+    return np.zeros((height, width, 3), dtype=np.uint8)
 
 # Print text to the center of the frame
 phrases = [
@@ -126,6 +200,12 @@ def print_phrase_to_frame(frame, phrase=0):
     cv2.putText(frame, text, (text_x, text_y), font, 1, (255, 255, 255), 2)
     return frame
 
+# The phrase screens are drawn and encoded once, then streamed from the cache
+def render_phrase_screen(phrase, width, height):
+    return print_phrase_to_frame(black_frame(width, height), phrase)
+
+phrase_screens = ScreenCache(render_phrase_screen, quality=JPEG_QUALITY)
+
 # Show gaze location
 def show_gaze_location(frame, horiz_ratio, verti_ratio, radius=10, color=(0, 255, 0)):
     x = int(horiz_ratio * frame.shape[1])
@@ -140,39 +220,124 @@ def draw_circles_around_eyes(frame, eye_location_left, eye_location_right):
         cv2.circle(frame, eye_location_right, 5, (0, 0, 255), 20)
     return frame
 
+# Show a cross on every pupil
+def show_eye_positions(frame, pupil_left, pupil_right, color=(0, 255, 0)):
+    for x, y in (pupil_left, pupil_right):
+        cv2.line(frame, (x - 5, y), (x + 5, y), color)
+        cv2.line(frame, (x, y - 5), (x, y + 5), color)
+    return frame
+
 # Show calibration points
 def show_calibration_points(frame):
     frame = show_gaze_location(frame, center_point[0], center_point[1], radius=10, color=(0, 0, 255))
     return frame
 
-def process_frame(frame):
-
-    if not GAZE_TRACKING_ENABLED:
-        return frame
-
-    frame = cv2.resize(frame, (640, 480))
+# Checks that the landmarks model is loaded. If its loading failed, the frames
+# stay raw: the error is reported once
+loading_reported = False
+def gaze_ready():
+    global loading_reported
+    if gaze.ready:
+        return True
+    if gaze.loading_error is not None and not loading_reported:
+        loading_reported = True
+        print(f"Landmarks model failed to load: {gaze.loading_error}")
+        metrics.count("model_loading_errors")
+    return False
+
+# Runs the gaze detection on a packet. Attaches the gaze result, the filtered
+# gaze ratios (None when the pupils aren't located) and the phrase to show
+# instead of the frame (None to show the frame)
+def detect_gaze(packet):
+    packet.result = None
+    packet.ratios = None
+    packet.phrase = None
+
+    if not GAZE_TRACKING_ENABLED or not gaze_ready():
+        return packet
+
+    packet.frame = cv2.resize(packet.frame, (640, 480))
 
     # Run gaze detection
     try:
-        gaze.refresh(frame)
+        packet.result = result = gaze.refresh(packet.frame)
     except:
-        print("Gaze refresh error. Skipping frame.")
-        return frame
-    
-    # Show eye positions
-    if SHOW_EYE_POSITIONS:
-        frame = gaze.annotated_frame()
-    
-    # Get gaze ratios
-    horiz_ratio = gaze.horizontal_ratio()
-    verti_ratio = gaze.vertical_ratio()
+        metrics.count("gaze_errors")
+        return packet
 
     # Proceed only if both gaze ratios are available
-    if (horiz_ratio is None or verti_ratio is None):
-        return frame
+    if not result.pupils_located:
+        return packet
+
+    # Get gaze ratios
+    horiz_ratio = result.horizontal_ratio
+    verti_ratio = result.vertical_ratio
+
+    # Refine the loaded calibration profile
+    if refining:
+        refine_center(horiz_ratio, verti_ratio)
+
+    # Apply low pass filter, at the time the frame was captured
+    packet.ratios = horiz_ratio, verti_ratio = ratio_filter((horiz_ratio, verti_ratio), packet.timestamp)
+
+    # If the user is gazing at the center, show the message
+    if SHOW_TEXT_MESSAGE and is_looking_down(verti_ratio):
+        packet.phrase = random_int % len(phrases)
+
+    # print(f"HR: {horiz_ratio} |  VR: {verti_ratio}")
+
+    return packet
+
+# Runs the gaze detection on the worker of gaze_sampler, and records the
+# filtered ratios it measured for the frames in between
+gaze_motion = LinearExtrapolator()
+def detect_in_background(packet):
+    packet = detect_gaze(packet)
+    if packet.ratios is None:
+        gaze_motion.reset()
+    else:
+        gaze_motion.update(packet.ratios, packet.timestamp)
+    return packet
+
+gaze_sampler = Sampler(detect_in_background, GAZE_DETECTION_RATE, metrics, name="gaze")
+
+# Attaches the latest gaze state to a packet, detected on an earlier frame by
+# gaze_sampler
+def attach_gaze(packet):
+    packet.result = None
+    packet.ratios = None
+    packet.phrase = None
+
+    if not GAZE_TRACKING_ENABLED or not gaze_ready():
+        return packet
 
-    # Apply low pass filter
-    horiz_ratio, verti_ratio = apply_ratio_filter(horiz_ratio, verti_ratio)
+    packet.frame = cv2.resize(packet.frame, (640, 480))
+
+    # The worker gets its own copy of the frame, the overlays are drawn on this one
+    gaze_sampler.submit(Packet(packet.sequence, packet.timestamp, packet.frame.copy()))
+
+    state = gaze_sampler.latest()
+    if state is None:
+        return packet
+    packet.result = state.result
+    packet.phrase = state.phrase
+    if state.ratios is not None:
+        packet.ratios = gaze_motion(packet.timestamp) if EXTRAPOLATE_GAZE else state.ratios
+    return packet
+
+# Draws the overlays of a packet on its frame
+def render_frame(packet):
+
+    # Nothing to draw without gaze ratios, nor on frames replaced by a phrase
+    if packet.ratios is None or packet.phrase is not None:
+        return packet
+
+    frame = packet.frame
+    horiz_ratio, verti_ratio = packet.ratios
+
+    # Show eye positions
+    if SHOW_EYE_POSITIONS:
+        frame = show_eye_positions(frame, packet.result.pupil_left, packet.result.pupil_right)
 
     # Show calibration points
     if SHOW_CALIBRATION_POINTS:
@@ -184,31 +349,22 @@ def process_frame(frame):
 
     # Get eye locations
     if COVER_EYES:
-        eye_location_left = gaze.pupil_left_coords()
-        eye_location_right = gaze.pupil_right_coords()
-        frame = draw_circles_around_eyes(frame, eye_location_left=eye_location_left, eye_location_right=eye_location_right)
+        frame = draw_circles_around_eyes(frame, eye_location_left=packet.result.pupil_left,
+                                         eye_location_right=packet.result.pupil_right)
 
-    # If the user is gazing at the center, show the message
-    if SHOW_TEXT_MESSAGE and is_looking_down(verti_ratio):
-        frame = black_frame()
-        frame = print_phrase_to_frame(frame, phrase=random_int)
-
-    # print(f"HR: {horiz_ratio} |  VR: {verti_ratio}")
-
-    return frame
+    packet.frame = frame
+    return packet
     
 
 ###########################
 ## FLASK WEB APPLICATION ##
 ###########################
 
-from flask import Flask, Response, render_template_string
+from flask import Flask, Response, render_template_string, jsonify
 
 app = Flask(__name__)
 
-@app.route('/')
-def index():
-    return render_template_string("""
+INDEX_PAGE = """
     <html>
     <head>
         <style>
@@ -235,40 +391,114 @@ def index():
         </script>
     </body>
     </html>
-    """)
+    """
+
+@app.route('/')
+def index():
+    return render_template_string(INDEX_PAGE)
 
 @app.route('/video_feed')
 def video_feed():
     return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
-def gen_frames():
-    while True:
-        
-        success, frame = cap.read()
-
-        if success:
+@app.route('/ready')
+def ready():
+    status = 200 if gaze.ready else 503
+    error = gaze.loading_error
+    return jsonify(ready=gaze.ready, loading_error=None if error is None else str(error)), status
+
+@app.route('/metrics')
+def metrics_route():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Takes the latest camera frame
+last_sequence = 0
+def capture_frame():
+    global last_sequence
+
+    latest = grabber.read(after=last_sequence)
+    if latest is None:
+        return None
+    last_sequence, timestamp, frame = latest
+    return Packet(last_sequence, timestamp, frame)
+
+def encode_frame(packet):
+
+    # Phrase screens are already encoded
+    if packet.phrase is not None:
+        metrics.count("cached_screens")
+        return EncodedFrame(packet.sequence, packet.timestamp,
+                            phrase_screens.jpeg(packet.phrase, image_width, image_height))
+
+    return EncodedFrame(packet.sequence, packet.timestamp, None, packet.frame, JPEG_QUALITY).encode()
+
+# Captures, detects, renders and encodes each frame once for all the clients.
+# Every stage runs on its own worker, so the slowest stage sets the frame rate
+processing = Pipeline([Stage("capture", capture_frame),
+                       Stage("detect", attach_gaze if GAZE_DECOUPLED else detect_gaze),
+                       Stage("render", render_frame),
+                       Stage("encode", encode_frame, workers=ENCODER_THREADS)],
+                      queue_size=1, metrics=metrics)
+
+pipeline = Broadcaster(processing.get, queue_size=2, metrics=metrics)
+
+# Adapts the stream of a viewer to its throughput, returns its (quality, scale)
+def adapt_quality(controller):
+    controller.tick()
+    change = controller.update(offered=metrics.rate("encode"))
+    if change < 0:
+        metrics.count("quality_decreases")
+    elif change > 0:
+        metrics.count("quality_increases")
+    return controller.level
 
-            frame = process_frame(frame)
+def gen_frames():
+    client = metrics.add_client()
+    subscription = pipeline.subscribe()
+    controller = QualityController(TARGET_FPS, QUALITY_LEVELS)
+    quality, scale = None, 1.0
+    try:
+        while True:
+            encoded = subscription.get(timeout=1.0)
+            if encoded is None:
+                continue
 
-            _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-            frame = buffer.tobytes()
-        
             # Yield the frame
-            yield (b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            chunk = encoded.multipart(quality, scale)
+            metrics.sent(client, len(chunk))
+            yield chunk
+
+            # The generator resumes once the frame is written to the viewer
+            if ADAPTIVE_QUALITY:
+                quality, scale = adapt_quality(controller)
+    finally:
+        pipeline.unsubscribe(subscription)
+        metrics.remove_client(client)
 
 #################
 ## ENTRY POINT ##
 #################
 
-if __name__ == '__main__':
+def setup():
 
     # Configure camera
     configure_camera()
 
-    # Calibrate gaze
+    # Render the phrase screens
+    phrase_screens.prerender(range(len(phrases)), image_width, image_height)
+
+    # Calibrate gaze, or load the calibration of the last launch
     if CALIBRATION_ENABLED:
-        calibrate_gaze()
+        if load_profile():
+            if PROFILE_REFINE:
+                start_refining()
+        else:
+            calibrate_gaze()
+            save_profile()
+
+if __name__ == '__main__':
+
+    setup()
 
     # Run the web application
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,192 @@
+import json
+import time
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+from streaming import AsyncServer, AsyncBroadcaster, AsyncSubscription, QualityController, respond, start_stream, accept
+
+######################
+## ASYNCIO SERVER ##
+######################
+
+# Same routes as the Flask application of app.py, served by coroutines
+# instead of a thread per viewer
+
+server = AsyncServer()
+
+# The gaze tracking and the encoding run in the stages of app.processing, out
+# of the event loop. A single worker thread waits for the encoded frames
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+pipeline = AsyncBroadcaster(app.processing.get, executor, queue_size=2, metrics=app.metrics)
+
+# Returns a variant of a frame (encoded.variant or encoded.multipart) for the
+# level of a viewer, encoding it out of the event loop when needed
+async def encode(method, encoded, quality, scale):
+    if encoded.is_encoded(quality, scale):
+        return method(quality, scale)
+    return await asyncio.get_running_loop().run_in_executor(None, method, quality, scale)
+
+# Page rendering the frames pushed on the WebSocket. Every message is
+# acknowledged on receipt. A frame is only drawn once the previous one is
+# decoded, and the frames received meanwhile are replaced by the newest one
+WEBSOCKET_PAGE = """
+    <html>
+    <head>
+        <style>
+            body, html {
+                margin: 0;
+                padding: 0;
+                overflow: hidden;
+                background: black;
+            }
+            img {
+                position: absolute;
+                top: 0;
+                left: 0;
+                width: 100%;
+                height: 100%;
+            }
+        </style>
+    </head>
+    <body onclick="refreshPage()">
+        <img id="frame">
+        <script>
+            const image = document.getElementById("frame");
+            let pending = null;
+            let drawing = false;
+            let shownUrl = null;
+
+            function draw() {
+                if (pending === null) {
+                    drawing = false;
+                    return;
+                }
+                drawing = true;
+                const url = URL.createObjectURL(pending);
+                pending = null;
+                image.onload = image.onerror = function() {
+                    if (shownUrl !== null) {
+                        URL.revokeObjectURL(shownUrl);
+                    }
+                    shownUrl = url;
+                    draw();
+                };
+                image.src = url;
+            }
+
+            function connect() {
+                const protocol = window.location.protocol === "https:" ? "wss://" : "ws://";
+                const socket = new WebSocket(protocol + window.location.host + "/ws");
+                socket.binaryType = "arraybuffer";
+                socket.onmessage = function(event) {
+                    // 4 bytes sequence number, 8 bytes capture time (ms), then the JPEG
+                    socket.send(new Uint8Array(event.data, 0, 4));
+                    pending = new Blob([new Uint8Array(event.data, 12)], {type: "image/jpeg"});
+                    if (!drawing) {
+                        draw();
+                    }
+                };
+                socket.onclose = function() {
+                    setTimeout(connect, 1000);
+                };
+            }
+
+            function refreshPage() {
+                window.location.reload();
+            }
+
+            connect();
+        </script>
+    </body>
+    </html>
+    """
+
+@server.route('/')
+async def index(request):
+    await respond(request.writer, 200, WEBSOCKET_PAGE, "text/html; charset=utf-8")
+
+@server.route('/mjpeg')
+async def mjpeg(request):
+    await respond(request.writer, 200, app.INDEX_PAGE, "text/html; charset=utf-8")
+
+# Frames sent to a WebSocket client and not acknowledged yet
+WEBSOCKET_WINDOW = 2
+
+@server.route('/ws')
+async def websocket(request):
+    socket = await accept(request)
+    if socket is None:
+        return
+
+    client = app.metrics.add_client()
+    # A single slot: a client that falls behind only gets the newest frame
+    subscription = pipeline.subscribe(AsyncSubscription(size=1))
+    listener = asyncio.ensure_future(socket.listen())
+    controller = QualityController(app.TARGET_FPS, app.QUALITY_LEVELS)
+    quality, scale = None, 1.0
+    sent = 0
+    try:
+        while not socket.closed.is_set():
+            # Don't queue frames in the network for a client that falls behind,
+            # the newest frame is taken once it caught up
+            await socket.wait_received(sent - WEBSOCKET_WINDOW + 1)
+            encoded = await subscription.get()
+
+            # Capture time as wall clock milliseconds
+            captured = (time.time() - (time.monotonic() - encoded.timestamp)) * 1000
+            jpeg = await encode(encoded.variant, encoded, quality, scale)
+            message = struct.pack(">Id", encoded.sequence & 0xFFFFFFFF, captured) + jpeg
+            await socket.send(message)
+            sent += 1
+            app.metrics.sent(client, len(message))
+
+            if app.ADAPTIVE_QUALITY:
+                quality, scale = app.adapt_quality(controller)
+    finally:
+        listener.cancel()
+        pipeline.unsubscribe(subscription)
+        app.metrics.remove_client(client)
+
+@server.route('/video_feed')
+async def video_feed(request):
+    writer = request.writer
+    client = app.metrics.add_client()
+    subscription = pipeline.subscribe()
+    controller = QualityController(app.TARGET_FPS, app.QUALITY_LEVELS)
+    quality, scale = None, 1.0
+    try:
+        await start_stream(writer, 'multipart/x-mixed-replace; boundary=frame')
+        while True:
+            encoded = await subscription.get()
+            chunk = await encode(encoded.multipart, encoded, quality, scale)
+            writer.write(chunk)
+            await writer.drain()
+            app.metrics.sent(client, len(chunk))
+
+            if app.ADAPTIVE_QUALITY:
+                quality, scale = app.adapt_quality(controller)
+    finally:
+        pipeline.unsubscribe(subscription)
+        app.metrics.remove_client(client)
+
+@server.route('/ready')
+async def ready(request):
+    status = 200 if app.gaze.ready else 503
+    await respond(request.writer, status, json.dumps({"ready": app.gaze.ready}), "application/json")
+
+@server.route('/metrics')
+async def metrics(request):
+    await respond(request.writer, 200, app.metrics.render(), "text/plain; version=0.0.4")
+
+#################
+## ENTRY POINT ##
+#################
+
+if __name__ == '__main__':
+
+    app.setup()
+
+    # Run the asyncio server
+    server.run(host='0.0.0.0', port=5000)
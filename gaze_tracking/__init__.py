@@ -1 +1,5 @@
 from .gaze_tracking import GazeTracking
+from .gaze_result import GazeResult
+from .calibration import Calibration
+from .instrumentation import StageTimer
+from .models import load_predictor
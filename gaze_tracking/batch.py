@@ -0,0 +1,177 @@
+from __future__ import division
+import os
+import argparse
+import threading
+import numpy as np
+import cv2
+from .gaze_tracking import GazeTracking
+from .gaze_result import GazeResult
+from .models import load_predictor, fork_context
+
+# Columns written for every frame, in the order of the rows returned by the workers
+COLUMNS = (
+    "horizontal_ratio", "vertical_ratio",
+    "pupil_left_x", "pupil_left_y", "pupil_right_x", "pupil_right_y",
+    "blinking_ratio", "blinking", "pupils_located",
+)
+
+# GazeTracking instance of a worker process
+_gaze = None
+
+
+def read_frames(path, size=None):
+    """Yields the frames of a video file, or of the images of a directory
+    in the alphabetical order of their names.
+
+    Arguments:
+        path (str): Path of the video file or of the directory
+        size (tuple): (width, height) the frames are resized to, if given
+    """
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        frames = (cv2.imread(os.path.join(path, name)) for name in names)
+    else:
+        frames = _read_video(path)
+
+    for frame in frames:
+        if frame is None:
+            continue
+        if size is not None:
+            frame = cv2.resize(frame, size)
+        yield frame
+
+
+def _read_video(path):
+    """Yields the frames of a video file"""
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def _init_worker(options):
+    """Creates the GazeTracking instance of a worker process"""
+    global _gaze
+    _gaze = GazeTracking(**options)
+
+
+def _analyze_frame(frame):
+    """Analyzes a frame in a worker process and returns its row of values"""
+    try:
+        result = _gaze.refresh(frame)
+    except Exception:
+        result = GazeResult.empty()
+    return result_row(result)
+
+
+def result_row(result):
+    """Converts a GazeResult to a tuple of values ordered as COLUMNS.
+    Missing values are NaN.
+
+    Argument:
+        result (GazeResult): Gaze analysis of a frame
+    """
+    nan = float("nan")
+    left = result.pupil_left or (nan, nan)
+    right = result.pupil_right or (nan, nan)
+    return (
+        nan if result.horizontal_ratio is None else result.horizontal_ratio,
+        nan if result.vertical_ratio is None else result.vertical_ratio,
+        left[0], left[1], right[0], right[1],
+        nan if result.blinking_ratio is None else result.blinking_ratio,
+        bool(result.is_blinking),
+        result.pupils_located,
+    )
+
+
+def _bounded(frames, semaphore, stop):
+    """Yields the frames, waiting for a free slot in the semaphore before each one,
+    so that the pool doesn't read the whole video in memory ahead of the workers.
+    Returns once the stop event is set, so that a pool terminated early doesn't
+    wait for its task handler thread blocked on the semaphore."""
+    for frame in frames:
+        while not semaphore.acquire(timeout=0.1):
+            if stop.is_set():
+                return
+        yield frame
+
+
+def analyze(frames, workers=None, chunksize=8, options=None):
+    """Analyzes frames across a pool of worker processes, each one with its own
+    GazeTracking instance. The landmarks model is loaded once before forking
+    the workers, which share it. Returns a dictionary of arrays, one per column,
+    in the order of the frames.
+
+    Arguments:
+        frames (iterable): Frames to analyze
+        workers (int): Number of worker processes (the number of CPUs by default)
+        chunksize (int): Number of consecutive frames sent to a worker at once
+        options (dict): Keyword arguments given to GazeTracking
+    """
+    workers = workers or os.cpu_count() or 1
+    semaphore = threading.Semaphore(workers * chunksize * 2)
+    stop = threading.Event()
+    rows = []
+
+    load_predictor()
+    context = fork_context()
+    with context.Pool(workers, initializer=_init_worker, initargs=(options or {},)) as pool:
+        try:
+            for row in pool.imap(_analyze_frame, _bounded(frames, semaphore, stop), chunksize):
+                rows.append(row)
+                semaphore.release()
+        finally:
+            # Interrupted or done: the frames aren't read anymore
+            stop.set()
+
+    columns = {"frame": np.arange(len(rows), dtype=np.int32)}
+    for index, name in enumerate(COLUMNS):
+        values = [row[index] for row in rows]
+        if name in ("blinking", "pupils_located"):
+            columns[name] = np.array(values, dtype=bool)
+        else:
+            columns[name] = np.array(values, dtype=np.float32)
+    return columns
+
+
+def _parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m gaze_tracking.batch",
+        description="Analyzes the gaze on every frame of a recorded video and "
+                    "saves the results as columns of a .npz file.")
+    parser.add_argument("input", help="video file or directory of images")
+    parser.add_argument("-o", "--output", help="output .npz file (input name by default)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=8, help="consecutive frames sent to a worker at once")
+    parser.add_argument("--size", type=_parse_size, default=None, help="resize the frames to WIDTHxHEIGHT")
+    parser.add_argument("--face-tracking", action="store_true", help="enable the face tracking mode")
+    parser.add_argument("--detection-scale", type=float, default=1, help="downscale factor of the face detector")
+    parser.add_argument("--pupil-engine", default="contours", choices=["contours", "components"])
+    args = parser.parse_args(args)
+
+    options = {
+        "face_tracking": args.face_tracking,
+        "detection_scale": args.detection_scale,
+        "pupil_engine": args.pupil_engine,
+    }
+    output = args.output or os.path.splitext(os.path.normpath(args.input))[0] + ".npz"
+
+    columns = analyze(read_frames(args.input, args.size), args.workers, args.chunksize, options)
+    np.savez_compressed(output, **columns)
+
+    located = int(columns["pupils_located"].sum())
+    print(f"Analyzed {len(columns['frame'])} frames ({located} with pupils located) into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+from __future__ import division
+import argparse
+import itertools
+import cv2
+import dlib
+import numpy as np
+from .gaze_tracking import GazeTracking
+from .instrumentation import StageTimer, STAGES
+from .batch import read_frames
+from .filters import FILTERS, create_filter
+from .models import load_predictor
+
+
+def synthetic_faces(count, size=(640, 480), seed=0):
+    """Returns reproducible frames of a drawn face whose irises move from one
+    side of the eyes to the other, and the fixed (68, 2) landmarks of the face
+    (only the points of the eyes follow the drawing).
+
+    Arguments:
+        count (int): Number of frames
+        size (tuple): (width, height) of the frames
+        seed (int): Seed of the random generator
+    """
+    generator = np.random.default_rng(seed)
+    width, height = size
+    center_x, center_y = width // 2, height // 2
+    face_width = int(width * 0.375)
+    axes = (face_width // 2, int(face_width * 0.65))
+
+    # Points on the outline of the face, replaced by the eyes for 36 to 47
+    angles = np.linspace(0, 2 * np.pi, 68, endpoint=False)
+    landmarks = np.stack((center_x + axes[0] * np.cos(angles), center_y + axes[1] * np.sin(angles)), axis=1)
+    eye_width, eye_height = face_width // 10, face_width // 26
+    eyes = []
+    for first, offset in ((36, -face_width // 5), (42, face_width // 5)):
+        x, y = center_x + offset, center_y - face_width // 10
+        points = [(x - eye_width, y), (x - eye_width // 3, y - eye_height), (x + eye_width // 3, y - eye_height),
+                  (x + eye_width, y), (x + eye_width // 3, y + eye_height), (x - eye_width // 3, y + eye_height)]
+        landmarks[first:first + 6] = points
+        eyes.append((x, y, np.array(points, np.int32)))
+    landmarks = landmarks.astype(np.int32)
+
+    background = np.full((height, width), 90, np.uint8)
+    cv2.ellipse(background, (center_x, center_y), axes, 0, 0, 360, 150, -1)
+    for _, _, points in eyes:
+        cv2.fillPoly(background, [points], 200)
+
+    frames = []
+    for index in range(count):
+        frame = background.copy()
+        shift = int(eye_width * 0.5 * np.sin(index * 0.2))
+        for x, y, _ in eyes:
+            cv2.circle(frame, (x + shift, y), eye_height, 40, -1)
+        noise = generator.normal(0, 8, frame.shape)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    return frames, landmarks
+
+
+def run(frames, options=None, warmup=5):
+    """Runs GazeTracking on the frames and returns the StageTimer holding
+    the durations of every stage.
+
+    Arguments:
+        frames (list): Frames to analyze
+        options (dict): Keyword arguments given to GazeTracking
+        warmup (int): Number of frames analyzed before the measurements start
+    """
+    # Large enough to keep the durations of every measured frame
+    timer = StageTimer(size=2 * max(len(frames) - warmup, 1))
+    gaze = GazeTracking(timer=timer, **(options or {}))
+
+    for frame in frames[:warmup]:
+        gaze.refresh(frame)
+    timer.reset()
+
+    for frame in frames[warmup:]:
+        gaze.refresh(frame)
+
+    return timer
+
+
+class FixedFace(object):
+    """
+    This class stands in for the face detector and the landmarks model of
+    GazeTracking on the frames of synthetic_faces(). The real models still run,
+    so their durations are measured, but since they can't fit a drawn face,
+    they return the rectangle and the landmarks of the drawing.
+
+    Arguments:
+        landmarks (numpy.ndarray): (68, 2) array of facial landmarks of the frames
+        width (int): Width of the frames
+    """
+
+    def __init__(self, landmarks, width):
+        self.width = width
+        (left, top), (right, bottom) = landmarks.min(axis=0), landmarks.max(axis=0)
+        self.face = (left, top, right, bottom)
+        self.points = [dlib.point(int(x), int(y)) for x, y in landmarks]
+        self._detector = dlib.get_frontal_face_detector()
+        self._predictor = load_predictor()
+
+    def detect(self, frame):
+        """Runs the face detector and returns the face, scaled like the frame
+        (GazeTracking downscales it with detection_scale)"""
+        self._detector(frame)
+        scale = frame.shape[1] / self.width
+        return [dlib.rectangle(*(int(value * scale) for value in self.face))]
+
+    def predict(self, frame, face):
+        """Runs the landmarks model and returns the landmarks of the drawing"""
+        self._predictor(frame, face)
+        return self
+
+    def parts(self):
+        """Returns the landmarks as dlib points, like dlib.full_object_detection"""
+        return self.points
+
+
+def summary(timer):
+    """Returns the statistics of the durations of every stage as a dictionary
+    stage -> (count, mean, p50, p99), in milliseconds, plus the end-to-end FPS
+
+    Argument:
+        timer (StageTimer): Timer returned by run()
+    """
+    stats = {}
+    for stage, (count, mean, p50, p99) in timer.summary().items():
+        if count == 0:
+            stats[stage] = (0, None, None, None)
+        else:
+            stats[stage] = (count, mean * 1000, p50 * 1000, p99 * 1000)
+
+    total = timer.total("total")
+    stats["fps"] = timer.count("total") / total if total > 0 else None
+    return stats
+
+
+def format_table(results):
+    """Formats the summaries of several configurations side by side
+
+    Argument:
+        results (list): (name, summary) pairs
+    """
+    def number(value, digits=2):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    columns = [name for name, _ in results]
+    lines = ["stage".ljust(14) + "".join(f"{name:>30}" for name in columns),
+             " " * 14 + "".join(f"{'n   mean    p50    p99 ms':>30}" for _ in columns)]
+    for stage in STAGES:
+        cells = []
+        for _, stats in results:
+            count, mean, p50, p99 = stats[stage]
+            cells.append(f"{count:>6} {number(mean):>7} {number(p50):>7} {number(p99):>7}")
+        lines.append(stage.ljust(14) + "".join(f"{cell:>30}" for cell in cells))
+    lines.append("fps".ljust(14) + "".join(f"{number(stats['fps'], 1):>30}" for _, stats in results))
+    return "\n".join(lines)
+
+
+# Rates of the gaze ratios in app.py: detected on every camera frame, or
+# decoupled from the camera at the rate of the background detection on a Pi
+REPLAY_RATES = (30, 8)
+
+# Standard deviations of the noise of the synthetic vertical ratios
+REPLAY_NOISES = (0.02, 0.04, 0.08, 0.12)
+
+
+def synthetic_gaze(rate=30, nb_steps=40, rest=1.5, down=1.0, step=0.35, noise=0.04, seed=0):
+    """Returns a reproducible vertical ratio signal where the viewer looks down
+    nb_steps times, with gaussian noise, the truth (1 while looking down) and
+    the timestamps of the values.
+
+    Arguments:
+        rate (float): Number of values per second
+        nb_steps (int): Number of times the viewer looks down
+        rest (float): Seconds looking at the center before every step
+        down (float): Seconds looking down
+        step (float): Increase of the vertical ratio while looking down
+        noise (float): Standard deviation of the noise
+        seed (int): Seed of the random generator
+    """
+    generator = np.random.default_rng(seed)
+    timestamps = np.arange(0, nb_steps * (rest + down), 1.0 / rate)
+    truth = (timestamps % (rest + down) >= rest).astype(int)
+    signal = 0.5 + step * truth + generator.normal(0, noise, len(truth))
+    return signal, truth, timestamps
+
+
+def replay(ratio_filter, signal, truth, timestamps, center=0.5, enter=0.25, exit=0.125):
+    """Replays a vertical ratio signal through a filter and the looking down
+    hysteresis of app.py. Returns the mean trigger latency (in seconds after
+    the viewer starts looking down) and the jitter (standard deviation of the
+    filtered signal once settled on a segment).
+
+    Arguments:
+        ratio_filter: Filter from gaze_tracking.filters
+        signal (numpy.ndarray): Vertical ratios
+        truth (numpy.ndarray): 1 on the values where the viewer looks down
+        timestamps (numpy.ndarray): Times of the values in seconds
+        center (float): Vertical ratio of the center
+        enter (float): Difference with the center that starts looking down
+        exit (float): Difference with the center that stops looking down
+    """
+    filtered = np.empty(len(signal))
+    triggered = np.zeros(len(signal), bool)
+    looking_down = False
+    for index, (value, timestamp) in enumerate(zip(signal, timestamps)):
+        filtered[index] = ratio_filter((0.5, value), timestamp)[1]
+        delta = filtered[index] - center
+        if delta > enter:
+            looking_down = True
+        elif delta < exit:
+            looking_down = False
+        triggered[index] = looking_down
+
+    # Segments of constant truth
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(truth)) + 1, [len(truth)]))
+    latencies, deviations = [], []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if truth[start]:
+            hits = np.flatnonzero(triggered[start:end])
+            last = hits[0] if len(hits) else end - 1 - start
+            latencies.append(timestamps[start + last] - timestamps[start])
+        settled = filtered[start + (end - start) // 2:end]
+        if len(settled) > 1:
+            deviations.append(settled.std())
+
+    return float(np.mean(latencies)) if latencies else None, float(np.mean(deviations))
+
+
+def replay_filters(path=None, clip_rate=30):
+    """Compares the filters on vertical ratio signals at the rates of app.py and
+    returns the table. The signals are the vertical_ratio column of a file saved
+    by gaze_tracking.batch, resampled at every rate (the truth being where a 5
+    frames median of the raw signal is looking down), or synthetic signals with
+    several noise levels.
+
+    Arguments:
+        path (str): Path of a .npz file saved by gaze_tracking.batch
+        clip_rate (float): Frame rate of the clip analyzed in the .npz file
+    """
+    signals = []
+    if path:
+        signal = np.load(path)["vertical_ratio"]
+        signal = signal[~np.isnan(signal)]
+        center = float(np.median(signal))
+        padded = np.pad(signal, 2, mode="edge")
+        median = np.median(np.lib.stride_tricks.sliding_window_view(padded, 5), axis=1)
+        truth = (median - center > 0.25).astype(int)
+        for rate in REPLAY_RATES:
+            timestamps = np.arange(0, len(signal) / clip_rate, 1.0 / rate)
+            indexes = np.minimum((timestamps * clip_rate).astype(int), len(signal) - 1)
+            signals.append((f"{rate} fps", rate, signal[indexes], truth[indexes], timestamps, center))
+    else:
+        for rate in REPLAY_RATES:
+            for noise in REPLAY_NOISES:
+                signal, truth, timestamps = synthetic_gaze(rate, noise=noise)
+                signals.append((f"{rate} fps, noise {noise}", rate, signal, truth, timestamps, 0.5))
+
+    lines = ["signal".ljust(22) + "".join(f"{name:>24}" for name in FILTERS),
+             " " * 22 + "".join(f"{'latency ms   jitter':>24}" for _ in FILTERS)]
+    for name, rate, signal, truth, timestamps, center in signals:
+        cells = []
+        for filter_name in FILTERS:
+            ratio_filter = create_filter(filter_name, rate, initial=(0.5, center))
+            latency, jitter = replay(ratio_filter, signal, truth, timestamps, center)
+            latency = "-" if latency is None else f"{latency * 1000:.0f}"
+            cells.append(f"{latency:>10} {jitter:>8.4f}")
+        lines.append(name.ljust(22) + "".join(f"{cell:>24}" for cell in cells))
+    return "\n".join(lines)
+
+
+def _parse_value(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    return text
+
+
+def _parse_config(text):
+    """Parses a configuration given as NAME:key=value,key=value"""
+    name, _, items = text.partition(":")
+    options = {}
+    for item in filter(None, items.split(",")):
+        key, value = item.split("=")
+        options[key.strip()] = _parse_value(value.strip())
+    return name, options
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m gaze_tracking.benchmark",
+        description="Measures the latency of every stage of the gaze tracking pipeline "
+                    "on a recorded clip (or synthetic faces) and compares configurations.")
+    parser.add_argument("input", nargs="?", help="video file or directory of images (synthetic faces if omitted)")
+    parser.add_argument("-n", "--frames", type=int, default=200, help="number of frames to analyze")
+    parser.add_argument("--warmup", type=int, default=5, help="frames analyzed before measuring")
+    parser.add_argument("--size", default="640x480", help="WIDTHxHEIGHT the frames are resized to")
+    parser.add_argument("-c", "--config", action="append", type=_parse_config, default=[],
+                        help="configuration to measure, as NAME:key=value,... with GazeTracking "
+                             "keyword arguments (repeat to compare)")
+    parser.add_argument("--replay", nargs="?", const="", metavar="NPZ",
+                        help="compare the ratio filters on the vertical ratios of a file saved by "
+                             "gaze_tracking.batch (or on a synthetic signal) instead")
+    parser.add_argument("--clip-rate", type=float, default=30, help="frame rate of the clip replayed")
+    args = parser.parse_args(args)
+
+    if args.replay is not None:
+        print(replay_filters(args.replay, args.clip_rate))
+        return
+
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    count = args.frames + args.warmup
+    configs = args.config or [("default", {})]
+    if args.input:
+        frames = list(itertools.islice(read_frames(args.input, (width, height)), count))
+        results = [(name, summary(run(frames, options, args.warmup))) for name, options in configs]
+    else:
+        frames, landmarks = synthetic_faces(count, (width, height))
+        face = FixedFace(landmarks, width)
+        results = [(name, summary(run(frames, dict(options, face_detector=face.detect, predictor=face.predict),
+                                      args.warmup)))
+                   for name, options in configs]
+    print(format_table(results))
+
+
+if __name__ == "__main__":
+    main()
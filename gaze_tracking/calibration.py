@@ -1,5 +1,7 @@
 from __future__ import division
+from collections import deque
 import cv2
+import numpy as np
 from .pupil import Pupil
 
 
@@ -7,17 +9,74 @@ class Calibration(object):
     """
     This class calibrates the pupil detection algorithm by finding the
     best binarization threshold value for the person and the webcam.
+
+    Once completed, the calibration can keep following the lighting with
+    a rolling recalibration: every rolling_interval frames, one eye frame is
+    evaluated and the threshold is averaged over the last window evaluations.
+
+    Arguments:
+        rolling_interval (int): Number of frames between two evaluations of an
+            eye after the calibration is completed (0 disables the recalibration)
+        window (int): Number of evaluations averaged in the rolling recalibration
     """
 
-    def __init__(self):
+    def __init__(self, rolling_interval=0, window=None):
         self.nb_frames = 20
-        self.thresholds_left = []
-        self.thresholds_right = []
+        self.rolling_interval = rolling_interval
+        self.window = max(window or self.nb_frames, self.nb_frames) if rolling_interval else None
+        self._reset([], [])
+
+    def _reset(self, thresholds_left, thresholds_right):
+        """Replaces the thresholds and their running sums"""
+        self.thresholds_left = deque(thresholds_left, maxlen=self.window)
+        self.thresholds_right = deque(thresholds_right, maxlen=self.window)
+        self._sums = [sum(self.thresholds_left), sum(self.thresholds_right)]
+        self._frame_counts = [0, 0]
 
     def is_complete(self):
         """Returns true if the calibration is completed"""
         return len(self.thresholds_left) >= self.nb_frames and len(self.thresholds_right) >= self.nb_frames
 
+    def needs_evaluation(self, side):
+        """Returns true if the frame of the given eye has to be evaluated.
+        It's the case until the calibration is completed, then once every
+        rolling_interval frames with the rolling recalibration. The right eye
+        is evaluated half an interval after the left one, so a frame never
+        evaluates both eyes.
+
+        Argument:
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        if not self.is_complete():
+            return True
+        if not self.rolling_interval:
+            return False
+
+        self._frame_counts[side] += 1
+        offset = 0 if side == 0 else self.rolling_interval // 2
+        return (self._frame_counts[side] + offset) % self.rolling_interval == 0
+
+    def state(self):
+        """Returns the calibration state as a dictionary that can be saved
+        (in a JSON file for example) and given back to load_state()"""
+        return {
+            "nb_frames": self.nb_frames,
+            "thresholds_left": list(self.thresholds_left),
+            "thresholds_right": list(self.thresholds_right),
+        }
+
+    def load_state(self, state):
+        """Restores a calibration state returned by state()
+
+        Argument:
+            state (dict): Calibration state
+        """
+        self.nb_frames = int(state.get("nb_frames", self.nb_frames))
+        if self.window is not None:
+            self.window = max(self.window, self.nb_frames)
+        self._reset([int(threshold) for threshold in state["thresholds_left"]],
+                    [int(threshold) for threshold in state["thresholds_right"]])
+
     def threshold(self, side):
         """Returns the threshold value for the given eye.
 
@@ -25,9 +84,9 @@ class Calibration(object):
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
         if side == 0:
-            return int(sum(self.thresholds_left) / len(self.thresholds_left))
+            return int(self._sums[0] / len(self.thresholds_left))
         elif side == 1:
-            return int(sum(self.thresholds_right) / len(self.thresholds_right))
+            return int(self._sums[1] / len(self.thresholds_right))
 
     @staticmethod
     def iris_size(frame):
@@ -43,10 +102,32 @@ class Calibration(object):
         nb_blacks = nb_pixels - cv2.countNonZero(frame)
         return nb_blacks / nb_pixels
 
+    @staticmethod
+    def iris_sizes(frame):
+        """Returns the iris size that every threshold value would give,
+        as an array indexed by the threshold.
+
+        Binarizing with a threshold t turns black the pixels whose value is
+        at most t, so the number of black pixels for every threshold is the
+        cumulative histogram of the filtered frame. Returns None when nothing
+        is left of the frame without its margin (like for a closed eye).
+
+        Argument:
+            frame (numpy.ndarray): Filtered eye frame, before its binarization
+        """
+        frame = frame[5:-5, 5:-5]
+        height, width = frame.shape[:2]
+        nb_pixels = height * width
+        if nb_pixels == 0:
+            return None
+        histogram = np.bincount(frame.ravel(), minlength=256)
+        return np.cumsum(histogram) / nb_pixels
+
     @staticmethod
     def find_best_threshold(eye_frame):
         """Calculates the optimal threshold to binarize the
-        frame for the given eye.
+        frame for the given eye. Returns None when the eye frame
+        is too small to be evaluated.
 
         Argument:
             eye_frame (numpy.ndarray): Frame of the eye to be analyzed
@@ -54,9 +135,11 @@ class Calibration(object):
         average_iris_size = 0.48
         trials = {}
 
+        iris_sizes = Calibration.iris_sizes(Pupil.filter_frame(eye_frame))
+        if iris_sizes is None:
+            return None
         for threshold in range(5, 100, 5):
-            iris_frame = Pupil.image_processing(eye_frame, threshold)
-            trials[threshold] = Calibration.iris_size(iris_frame)
+            trials[threshold] = iris_sizes[threshold]
 
         best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - average_iris_size)))
         return best_threshold
@@ -70,8 +153,18 @@ class Calibration(object):
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
         threshold = self.find_best_threshold(eye_frame)
+        if threshold is None:
+            return
 
         if side == 0:
-            self.thresholds_left.append(threshold)
+            thresholds = self.thresholds_left
         elif side == 1:
-            self.thresholds_right.append(threshold)
+            thresholds = self.thresholds_right
+        else:
+            return
+
+        # Keep the running sum of the window
+        if len(thresholds) == thresholds.maxlen:
+            self._sums[side] -= thresholds[0]
+        thresholds.append(threshold)
+        self._sums[side] += threshold
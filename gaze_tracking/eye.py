@@ -1,9 +1,35 @@
 import math
+import time
 import numpy as np
 import cv2
 from .pupil import Pupil
 
 
+class MaskBuffer(object):
+    """
+    This class keeps a buffer that is reused to build the eye masks,
+    so that a new mask doesn't need to be allocated for every eye.
+    """
+
+    def __init__(self):
+        self._buffer = np.empty((0, 0), np.uint8)
+
+    def mask(self, height, width):
+        """Returns a white (height, width) mask backed by the buffer
+
+        Arguments:
+            height (int): Height of the mask
+            width (int): Width of the mask
+        """
+        buffer_height, buffer_width = self._buffer.shape
+        if buffer_height < height or buffer_width < width:
+            self._buffer = np.empty((max(height, buffer_height), max(width, buffer_width)), np.uint8)
+
+        mask = self._buffer[:height, :width]
+        mask.fill(255)
+        return mask
+
+
 class Eye(object):
     """
     This class creates a new frame to isolate the eye and
@@ -13,12 +39,16 @@ class Eye(object):
     LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
     RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
 
-    def __init__(self, original_frame, landmarks, side, calibration):
+    def __init__(self, original_frame, landmarks, side, calibration, mask_buffer=None, pupil_engine=Pupil.CONTOURS,
+                 timer=None):
         self.frame = None
         self.origin = None
         self.center = None
         self.pupil = None
         self.landmark_points = None
+        self._mask_buffer = mask_buffer if mask_buffer is not None else MaskBuffer()
+        self._pupil_engine = pupil_engine
+        self._timer = timer
 
         self._analyze(original_frame, landmarks, side, calibration)
 
@@ -27,11 +57,11 @@ class Eye(object):
         """Returns the middle point (x,y) between two points
 
         Arguments:
-            p1 (dlib.point): First point
-            p2 (dlib.point): Second point
+            p1 (numpy.ndarray): First point
+            p2 (numpy.ndarray): Second point
         """
-        x = int((p1.x + p2.x) / 2)
-        y = int((p1.y + p2.y) / 2)
+        x = int((p1[0] + p2[0]) / 2)
+        y = int((p1[1] + p2[1]) / 2)
         return (x, y)
 
     def _isolate(self, frame, landmarks, points):
@@ -39,30 +69,26 @@ class Eye(object):
 
         Arguments:
             frame (numpy.ndarray): Frame containing the face
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
         """
-        region = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
-        region = region.astype(np.int32)
+        region = landmarks[points]
         self.landmark_points = region
 
-        # Applying a mask to get only the eye
-        height, width = frame.shape[:2]
-        black_frame = np.zeros((height, width), np.uint8)
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [region], (0, 0, 0))
-        eye = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
-
         # Cropping on the eye
         margin = 5
-        min_x = np.min(region[:, 0]) - margin
-        max_x = np.max(region[:, 0]) + margin
-        min_y = np.min(region[:, 1]) - margin
-        max_y = np.max(region[:, 1]) + margin
-
-        self.frame = eye[min_y:max_y, min_x:max_x]
+        height, width = frame.shape[:2]
+        min_x = max(np.min(region[:, 0]) - margin, 0)
+        max_x = min(np.max(region[:, 0]) + margin, width)
+        min_y = max(np.min(region[:, 1]) - margin, 0)
+        max_y = min(np.max(region[:, 1]) + margin, height)
         self.origin = (min_x, min_y)
 
+        # Applying a mask to get only the eye, in the coordinates of the crop
+        mask = self._mask_buffer.mask(max_y - min_y, max_x - min_x)
+        cv2.fillPoly(mask, [(region - self.origin).astype(np.int32)], (0, 0, 0))
+        self.frame = cv2.bitwise_or(frame[min_y:max_y, min_x:max_x], mask)
+
         height, width = self.frame.shape[:2]
         self.center = (width / 2, height / 2)
 
@@ -71,16 +97,16 @@ class Eye(object):
         It's the division of the width of the eye, by its height.
 
         Arguments:
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
 
         Returns:
             The computed ratio
         """
-        left = (landmarks.part(points[0]).x, landmarks.part(points[0]).y)
-        right = (landmarks.part(points[3]).x, landmarks.part(points[3]).y)
-        top = self._middle_point(landmarks.part(points[1]), landmarks.part(points[2]))
-        bottom = self._middle_point(landmarks.part(points[5]), landmarks.part(points[4]))
+        left = landmarks[points[0]]
+        right = landmarks[points[3]]
+        top = self._middle_point(landmarks[points[1]], landmarks[points[2]])
+        bottom = self._middle_point(landmarks[points[5]], landmarks[points[4]])
 
         eye_width = math.hypot((left[0] - right[0]), (left[1] - right[1]))
         eye_height = math.hypot((top[0] - bottom[0]), (top[1] - bottom[1]))
@@ -98,7 +124,7 @@ class Eye(object):
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
         """
@@ -109,11 +135,27 @@ class Eye(object):
         else:
             return
 
+        timer = self._timer
+        if timer is not None:
+            start = time.perf_counter()
+
         self.blinking = self._blinking_ratio(landmarks, points)
         self._isolate(original_frame, landmarks, points)
 
-        if not calibration.is_complete():
+        if timer is not None:
+            isolated = time.perf_counter()
+            timer.record("isolate", isolated - start)
+
+        if calibration.needs_evaluation(side):
             calibration.evaluate(self.frame, side)
 
+            if timer is not None:
+                calibrated = time.perf_counter()
+                timer.record("calibration", calibrated - isolated)
+                isolated = calibrated
+
         threshold = calibration.threshold(side)
-        self.pupil = Pupil(self.frame, threshold)
+        self.pupil = Pupil(self.frame, threshold, self._pupil_engine)
+
+        if timer is not None:
+            timer.record("pupil", time.perf_counter() - isolated)
@@ -0,0 +1,187 @@
+from __future__ import division
+import math
+
+
+class ExponentialFilter(object):
+    """
+    This class smooths the gaze ratios with a fixed exponential average:
+    every new value weighs 1 / (size + 1) of the result.
+
+    Arguments:
+        size (int): Weight of the previous result
+        initial (tuple): Value the filter starts from
+    """
+
+    def __init__(self, size=3, initial=(0.5, 0.5)):
+        self.size = size
+        self.value = tuple(initial)
+
+    def reset(self, value):
+        """Restarts the filter from the given value"""
+        self.value = tuple(value)
+
+    def state(self):
+        """Returns the state of the filter as a list that can be saved"""
+        return list(self.value)
+
+    def load_state(self, state):
+        """Restores a state returned by state()"""
+        self.reset(state[:2])
+
+    def __call__(self, value, timestamp=None):
+        """Filters a new value and returns the smoothed one
+
+        Arguments:
+            value (tuple): Horizontal and vertical ratios
+            timestamp (float): Time of the value in seconds (not used)
+        """
+        self.value = tuple((previous * self.size + new) / (self.size + 1)
+                           for previous, new in zip(self.value, value))
+        return self.value
+
+
+class OneEuroFilter(object):
+    """
+    This class smooths the gaze ratios with the 1€ filter (Casiez et al., 2012):
+    a low-pass filter whose cutoff frequency rises with the speed of the gaze.
+    Slow movements (or noise around a fixed point) are strongly smoothed while
+    fast movements go through with little lag.
+
+    Arguments:
+        min_cutoff (float): Cutoff frequency (Hz) when the gaze doesn't move
+        beta (float): Increase of the cutoff frequency with the speed of the gaze
+        d_cutoff (float): Cutoff frequency (Hz) used to smooth the speed
+        frequency (float): Rate of the values (Hz), used when they have no timestamp
+        initial (tuple): Value the filter starts from
+    """
+
+    def __init__(self, min_cutoff=0.1, beta=1.5, d_cutoff=0.5, frequency=30.0, initial=(0.5, 0.5)):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.frequency = frequency
+        self.reset(initial)
+
+    def reset(self, value):
+        """Restarts the filter from the given value"""
+        self.value = tuple(value)
+        self.speed = (0.0,) * len(self.value)
+        self.timestamp = None
+
+    def state(self):
+        """Returns the state of the filter as a list that can be saved"""
+        return list(self.value)
+
+    def load_state(self, state):
+        """Restores a state returned by state()"""
+        self.reset(state[:2])
+
+    @staticmethod
+    def _alpha(cutoff, period):
+        """Returns the smoothing factor of a low-pass filter"""
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / period)
+
+    def __call__(self, value, timestamp=None):
+        """Filters a new value and returns the smoothed one
+
+        Arguments:
+            value (tuple): Horizontal and vertical ratios
+            timestamp (float): Time of the value in seconds. Values are
+                assumed to come at the given frequency when it's missing
+        """
+        if timestamp is None or self.timestamp is None or timestamp <= self.timestamp:
+            period = 1.0 / self.frequency
+        else:
+            period = timestamp - self.timestamp
+        self.timestamp = timestamp
+
+        alpha_speed = self._alpha(self.d_cutoff, period)
+        values, speeds = [], []
+        for previous, previous_speed, new in zip(self.value, self.speed, value):
+            speed = previous_speed + alpha_speed * ((new - previous) / period - previous_speed)
+            cutoff = self.min_cutoff + self.beta * abs(speed)
+            values.append(previous + self._alpha(cutoff, period) * (new - previous))
+            speeds.append(speed)
+
+        self.value = tuple(values)
+        self.speed = tuple(speeds)
+        return self.value
+
+
+class LinearExtrapolator(object):
+    """
+    This class predicts the gaze ratios between two measures, when they are
+    measured at a lower rate than the frames they are drawn on. The ratios
+    follow the line of the last two measures, for at most horizon seconds
+    after the last one.
+
+    Arguments:
+        horizon (float): Maximum prediction time after the last measure, in seconds
+    """
+
+    def __init__(self, horizon=0.25):
+        self.horizon = horizon
+        self.reset()
+
+    def reset(self):
+        """Forgets the measures, like when the pupils are lost"""
+        self._measures = []
+
+    def update(self, value, timestamp):
+        """Adds a measure
+
+        Arguments:
+            value (tuple): Horizontal and vertical ratios
+            timestamp (float): Time of the measure in seconds
+        """
+        self._measures = self._measures[-1:] + [(timestamp, tuple(value))]
+
+    def __call__(self, timestamp):
+        """Returns the ratios predicted at the given time, or None without measures
+
+        Argument:
+            timestamp (float): Time of the prediction in seconds
+        """
+        measures = self._measures
+        if not measures:
+            return None
+        last_time, last = measures[-1]
+        if len(measures) < 2 or measures[0][0] >= last_time:
+            return last
+
+        first_time, first = measures[0]
+        elapsed = min(max(timestamp - last_time, first_time - last_time), self.horizon)
+        return tuple(new + (new - previous) * elapsed / (last_time - first_time)
+                     for previous, new in zip(first, last))
+
+
+# Filters that can be chosen by name
+FILTERS = {
+    "exponential": ExponentialFilter,
+    "one_euro": OneEuroFilter,
+}
+
+# Settings of the filters for the rates of the gaze ratios (values per second):
+# detected on every camera frame, or decoupled from the camera on a Raspberry Pi.
+# Tuned with the replay of gaze_tracking.benchmark
+FILTER_SETTINGS = {
+    "one_euro": {
+        30: {"min_cutoff": 0.1, "beta": 1.5, "d_cutoff": 0.5},
+        8: {"min_cutoff": 0.05, "beta": 0.5, "d_cutoff": 1.0},
+    },
+}
+
+
+def create_filter(name, rate=30, initial=(0.5, 0.5)):
+    """Returns a filter chosen by name, with the settings tuned for the rate
+    closest to the rate of the values
+
+    Arguments:
+        name (str): Name of the filter in FILTERS
+        rate (float): Number of values per second
+        initial (tuple): Value the filter starts from
+    """
+    settings = FILTER_SETTINGS.get(name)
+    options = settings[min(settings, key=lambda tuned: abs(tuned - rate))] if settings else {}
+    return FILTERS[name](initial=initial, **options)
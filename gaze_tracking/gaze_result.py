@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+
+class GazeResult(namedtuple("GazeResult", [
+        "pupils_located", "horizontal_ratio", "vertical_ratio",
+        "pupil_left", "pupil_right", "blinking_ratio"])):
+    """
+    This class is an immutable snapshot of the gaze analysis of a frame.
+    Every value is computed once by GazeTracking.refresh() and the fields
+    are None when the pupils couldn't be located.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def empty(cls):
+        """Returns the result of a frame where the pupils couldn't be located"""
+        return cls(False, None, None, None, None, None)
+
+    @property
+    def is_right(self):
+        """True if the user is looking to the right"""
+        if self.pupils_located:
+            return self.horizontal_ratio <= 0.35
+
+    @property
+    def is_left(self):
+        """True if the user is looking to the left"""
+        if self.pupils_located:
+            return self.horizontal_ratio >= 0.65
+
+    @property
+    def is_center(self):
+        """True if the user is looking to the center"""
+        if self.pupils_located:
+            return 0.35 < self.horizontal_ratio < 0.65
+
+    @property
+    def is_blinking(self):
+        """True if the user closes their eyes"""
+        if self.pupils_located and self.blinking_ratio is not None:
+            return self.blinking_ratio > 3.8
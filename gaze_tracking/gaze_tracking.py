@@ -1,9 +1,14 @@
 from __future__ import division
-import os
+import time
+import threading
+import numpy as np
 import cv2
 import dlib
-from .eye import Eye
+from .eye import Eye, MaskBuffer
 from .calibration import Calibration
+from .pupil import Pupil
+from .gaze_result import GazeResult
+from .models import load_predictor, LANDMARKS_MODEL_PATH
 
 
 class GazeTracking(object):
@@ -11,120 +16,387 @@ class GazeTracking(object):
     This class tracks the user's gaze.
     It provides useful information like the position of the eyes
     and pupils and allows to know if the eyes are open or closed
+
+    Arguments:
+        face_tracking (bool): Reuse the face found in the previous frame instead
+            of running the face detector on every frame
+        redetect_interval (int): Maximum number of frames between two runs of
+            the face detector when face tracking is enabled
+        tracking_margin (float): Tolerance, relative to the face size, allowed
+            for the landmarks before the tracked face is considered lost. The
+            face is also looked for in its rectangle expanded by this margin
+        detection_scale (float): Factor by which the frame is downscaled before
+            running the face detector. The landmarks and the eyes are still
+            analyzed at full resolution
+        pupil_engine (str): Method used to locate the iris, either
+            Pupil.CONTOURS or Pupil.COMPONENTS
+        timer (instrumentation.StageTimer): Records the duration of every stage
+            of the analysis when given. Disabled by default
+        background_loading (bool): Load the landmarks model in a background thread
+            instead of blocking the constructor. refresh() waits for the model
+        calibration (calibration.Calibration): Calibration to use, for example
+            with a rolling recalibration. A new one by default
+        face_detector (callable): Returns the face rectangles (dlib.rectangle) of
+            a grayscale frame. The dlib frontal face detector by default
+        predictor (callable): Returns the facial landmarks (dlib.full_object_detection)
+            of a face rectangle in a grayscale frame. The landmarks model by default
     """
 
-    def __init__(self):
+    def __init__(self, face_tracking=False, redetect_interval=10, tracking_margin=0.25, detection_scale=1,
+                 pupil_engine=Pupil.CONTOURS, timer=None, background_loading=False, calibration=None,
+                 face_detector=None, predictor=None):
         self.frame = None
         self.eye_left = None
         self.eye_right = None
-        self.calibration = Calibration()
+        self.landmarks = None
+        self.result = GazeResult.empty()
+        self.calibration = calibration if calibration is not None else Calibration()
+        self._mask_buffer = MaskBuffer()
+
+        self.face_tracking = face_tracking
+        self.redetect_interval = redetect_interval
+        self.tracking_margin = tracking_margin
+        self.detection_scale = detection_scale
+        self.pupil_engine = pupil_engine
+        self.timer = timer
+        self._face = None
+        self._face_offset = None
+        self._face_width = None
+        self._frames_since_detection = 0
 
         # _face_detector is used to detect faces
-        self._face_detector = dlib.get_frontal_face_detector()
+        self._face_detector = face_detector if face_detector is not None else dlib.get_frontal_face_detector()
+
+        # _predictor is used to get facial landmarks of a given face,
+        # it is shared by all the instances of the process
+        model_path = LANDMARKS_MODEL_PATH
+        self._predictor = predictor
+        self._loading_error = None
+        self._loaded = threading.Event()
+
+        if predictor is not None:
+            self._loaded.set()
+        elif background_loading:
+            thread = threading.Thread(target=self._load_predictor, args=(model_path,), daemon=True)
+            thread.start()
+        else:
+            self._load_predictor(model_path)
+            self.wait_ready()
+
+    def _load_predictor(self, model_path):
+        """Loads the landmarks model
 
-        # _predictor is used to get facial landmarks of a given face
-        cwd = os.path.abspath(os.path.dirname(__file__))
-        model_path = os.path.abspath(os.path.join(cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
-        self._predictor = dlib.shape_predictor(model_path)
+        Argument:
+            model_path (str): Path of the model file
+        """
+        try:
+            self._predictor = load_predictor(model_path)
+        except Exception as error:
+            self._loading_error = error
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self):
+        """Check that the landmarks model is loaded"""
+        return self._loaded.is_set() and self._loading_error is None
+
+    @property
+    def loading_error(self):
+        """Returns the error raised while loading the landmarks model,
+        None if it's loaded or still loading"""
+        return self._loading_error
+
+    def wait_ready(self, timeout=None):
+        """Waits for the landmarks model to be loaded. Returns false if it's
+        still loading after the timeout, and raises the error of the loading
+        if it failed.
+
+        Argument:
+            timeout (float): Maximum waiting time in seconds (no limit by default)
+        """
+        if not self._loaded.wait(timeout):
+            return False
+        if self._loading_error is not None:
+            raise self._loading_error
+        return True
 
     @property
     def pupils_located(self):
         """Check that the pupils have been located"""
-        try:
-            int(self.eye_left.pupil.x)
-            int(self.eye_left.pupil.y)
-            int(self.eye_right.pupil.x)
-            int(self.eye_right.pupil.y)
-            return True
-        except Exception:
+        return self.result.pupils_located
+
+    @staticmethod
+    def _landmarks_array(shape):
+        """Converts the facial landmarks to a (68, 2) array of (x, y) coordinates
+
+        Argument:
+            shape (dlib.full_object_detection): Facial landmarks for the face region
+        """
+        return np.array([(point.x, point.y) for point in shape.parts()], dtype=np.int32)
+
+    @staticmethod
+    def _landmark_bounds(landmarks):
+        """Returns the bounding box (left, top, right, bottom) of the landmarks
+
+        Argument:
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks
+        """
+        left, top = landmarks.min(axis=0)
+        right, bottom = landmarks.max(axis=0)
+        return int(left), int(top), int(right), int(bottom)
+
+    def _predict(self, frame, face):
+        """Returns the facial landmarks of the face as a (68, 2) array
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            face (dlib.rectangle): Region of the face
+        """
+        if self.timer is not None:
+            start = time.perf_counter()
+            landmarks = self._landmarks_array(self._predictor(frame, face))
+            self.timer.record("landmarks", time.perf_counter() - start)
+            return landmarks
+
+        return self._landmarks_array(self._predictor(frame, face))
+
+    def _track_face(self, frame):
+        """Predicts the landmarks inside the face rectangle of the previous frame.
+        Returns None when the tracked face has to be detected again.
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        if not self.face_tracking or self._face is None:
+            return None
+        if self._frames_since_detection >= self.redetect_interval:
+            return None
+
+        # The landmarks model fits a face anywhere, even on the background
+        if self.timer is not None:
+            start = time.perf_counter()
+            present = self._face_in_region(frame)
+            self.timer.record("detection", time.perf_counter() - start)
+        else:
+            present = self._face_in_region(frame)
+        if not present:
+            return None
+
+        landmarks = self._predict(frame, self._face)
+
+        # The fit has degraded if the landmarks leave the face rectangle
+        # (expanded by the margin) or if the face changed size
+        left, top, right, bottom = self._landmark_bounds(landmarks)
+        margin_x = self.tracking_margin * self._face.width()
+        margin_y = self.tracking_margin * self._face.height()
+        if (left < self._face.left() - margin_x or right > self._face.right() + margin_x or
+                top < self._face.top() - margin_y or bottom > self._face.bottom() + margin_y):
+            return None
+        if abs((right - left) - self._face_width) > self.tracking_margin * self._face_width:
+            return None
+
+        self._frames_since_detection += 1
+        return landmarks
+
+    def _face_in_region(self, frame):
+        """Checks that the tracked face is still in its rectangle expanded by the
+        margin, by running the face detector on this region only. The region is
+        downscaled so the face is about 100 pixels wide (the detector finds faces
+        from 80 pixels), so the check costs a fraction of a detection.
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        face = self._face
+        margin_x = int(self.tracking_margin * face.width())
+        margin_y = int(self.tracking_margin * face.height())
+        height, width = frame.shape[:2]
+        region = frame[max(face.top() - margin_y, 0):min(face.bottom() + margin_y, height),
+                       max(face.left() - margin_x, 0):min(face.right() + margin_x, width)]
+        if region.size == 0:
             return False
 
+        scale = face.width() / 100
+        if scale > 1:
+            region = cv2.resize(region, (int(region.shape[1] / scale), int(region.shape[0] / scale)),
+                                interpolation=cv2.INTER_AREA)
+        return len(self._face_detector(np.ascontiguousarray(region))) > 0
+
+    def _find_faces(self, frame):
+        """Runs the face detector on a downscaled copy of the frame and returns
+        the face rectangles in full resolution coordinates
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        scale = self.detection_scale
+        if scale <= 1:
+            return self._face_detector(frame)
+
+        height, width = frame.shape[:2]
+        small_frame = cv2.resize(frame, (int(width / scale), int(height / scale)), interpolation=cv2.INTER_AREA)
+        faces = self._face_detector(small_frame)
+        return [dlib.rectangle(int(face.left() * scale), int(face.top() * scale),
+                               int(face.right() * scale), int(face.bottom() * scale)) for face in faces]
+
+    def _detect_face(self, frame):
+        """Runs the face detector and predicts the landmarks of the first face found.
+        Returns None when there is no face in the frame.
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        if self.timer is not None:
+            start = time.perf_counter()
+            faces = self._find_faces(frame)
+            self.timer.record("detection", time.perf_counter() - start)
+        else:
+            faces = self._find_faces(frame)
+
+        if len(faces) == 0:
+            self._face = None
+            return None
+
+        self._face = faces[0]
+        landmarks = self._predict(frame, self._face)
+
+        # Remember where the landmarks sit in the detected rectangle so the
+        # rectangle can follow them on the next frames
+        left, top, right, bottom = self._landmark_bounds(landmarks)
+        center = self._face.center()
+        self._face_offset = ((left + right) // 2 - center.x, (top + bottom) // 2 - center.y)
+        self._face_width = right - left
+        self._frames_since_detection = 0
+        return landmarks
+
+    def _follow_face(self, landmarks):
+        """Moves the face rectangle to follow the landmarks of the current frame
+
+        Argument:
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks
+        """
+        left, top, right, bottom = self._landmark_bounds(landmarks)
+        x = (left + right) // 2 - self._face_offset[0] - self._face.center().x
+        y = (top + bottom) // 2 - self._face_offset[1] - self._face.center().y
+        self._face = dlib.translate_rect(self._face, dlib.point(x, y))
+
     def _analyze(self):
         """Detects the face and initialize Eye objects"""
         frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-        faces = self._face_detector(frame)
 
-        try:
-            landmarks = self._predictor(frame, faces[0])
-            self.eye_left = Eye(frame, landmarks, 0, self.calibration)
-            self.eye_right = Eye(frame, landmarks, 1, self.calibration)
+        landmarks = self._track_face(frame)
+        if landmarks is None:
+            landmarks = self._detect_face(frame)
 
-        except IndexError:
+        self.landmarks = landmarks
+        if landmarks is None:
             self.eye_left = None
             self.eye_right = None
+            return
+
+        if self.face_tracking:
+            self._follow_face(landmarks)
+
+        self.eye_left = Eye(frame, landmarks, 0, self.calibration, self._mask_buffer, self.pupil_engine, self.timer)
+        self.eye_right = Eye(frame, landmarks, 1, self.calibration, self._mask_buffer, self.pupil_engine, self.timer)
+
+    def _result(self):
+        """Computes the gaze values of the analyzed frame"""
+        try:
+            left_x = int(self.eye_left.pupil.x)
+            left_y = int(self.eye_left.pupil.y)
+            right_x = int(self.eye_right.pupil.x)
+            right_y = int(self.eye_right.pupil.y)
+        except Exception:
+            return GazeResult.empty()
+
+        pupil_left = (int(self.eye_left.origin[0]) + left_x, int(self.eye_left.origin[1]) + left_y)
+        pupil_right = (int(self.eye_right.origin[0]) + right_x, int(self.eye_right.origin[1]) + right_y)
+
+        horizontal_left = left_x / (self.eye_left.center[0] * 2 - 10)
+        horizontal_right = right_x / (self.eye_right.center[0] * 2 - 10)
+        vertical_left = left_y / (self.eye_left.center[1] * 2 - 10)
+        vertical_right = right_y / (self.eye_right.center[1] * 2 - 10)
+
+        if self.eye_left.blinking is None or self.eye_right.blinking is None:
+            blinking_ratio = None
+        else:
+            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
+
+        return GazeResult(True, (horizontal_left + horizontal_right) / 2, (vertical_left + vertical_right) / 2,
+                          pupil_left, pupil_right, blinking_ratio)
 
     def refresh(self, frame):
         """Refreshes the frame and analyzes it.
 
         Arguments:
             frame (numpy.ndarray): The frame to analyze
+
+        Returns:
+            The GazeResult of the frame
         """
+        self.wait_ready()
+
+        if self.timer is not None:
+            start = time.perf_counter()
+
         self.frame = frame
+        self.landmarks = None
+        self.result = GazeResult.empty()
         self._analyze()
+        self.result = self._result()
+
+        if self.timer is not None:
+            self.timer.record("total", time.perf_counter() - start)
+        return self.result
 
     def pupil_left_coords(self):
         """Returns the coordinates of the left pupil"""
-        if self.pupils_located:
-            x = self.eye_left.origin[0] + self.eye_left.pupil.x
-            y = self.eye_left.origin[1] + self.eye_left.pupil.y
-            return (x, y)
+        return self.result.pupil_left
 
     def pupil_right_coords(self):
         """Returns the coordinates of the right pupil"""
-        if self.pupils_located:
-            x = self.eye_right.origin[0] + self.eye_right.pupil.x
-            y = self.eye_right.origin[1] + self.eye_right.pupil.y
-            return (x, y)
+        return self.result.pupil_right
 
     def horizontal_ratio(self):
         """Returns a number between 0.0 and 1.0 that indicates the
         horizontal direction of the gaze. The extreme right is 0.0,
         the center is 0.5 and the extreme left is 1.0
         """
-        if self.pupils_located:
-            pupil_left = self.eye_left.pupil.x / (self.eye_left.center[0] * 2 - 10)
-            pupil_right = self.eye_right.pupil.x / (self.eye_right.center[0] * 2 - 10)
-            return (pupil_left + pupil_right) / 2
+        return self.result.horizontal_ratio
 
     def vertical_ratio(self):
         """Returns a number between 0.0 and 1.0 that indicates the
         vertical direction of the gaze. The extreme top is 0.0,
         the center is 0.5 and the extreme bottom is 1.0
         """
-        if self.pupils_located:
-            pupil_left = self.eye_left.pupil.y / (self.eye_left.center[1] * 2 - 10)
-            pupil_right = self.eye_right.pupil.y / (self.eye_right.center[1] * 2 - 10)
-            return (pupil_left + pupil_right) / 2
+        return self.result.vertical_ratio
 
     def is_right(self):
         """Returns true if the user is looking to the right"""
-        if self.pupils_located:
-            return self.horizontal_ratio() <= 0.35
+        return self.result.is_right
 
     def is_left(self):
         """Returns true if the user is looking to the left"""
-        if self.pupils_located:
-            return self.horizontal_ratio() >= 0.65
+        return self.result.is_left
 
     def is_center(self):
         """Returns true if the user is looking to the center"""
-        if self.pupils_located:
-            return self.is_right() is not True and self.is_left() is not True
+        return self.result.is_center
 
     def is_blinking(self):
         """Returns true if the user closes his eyes"""
-        if self.pupils_located:
-            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
-            return blinking_ratio > 3.8
+        return self.result.is_blinking
 
     def annotated_frame(self):
         """Returns the main frame with pupils highlighted"""
         frame = self.frame.copy()
 
-        if self.pupils_located:
+        if self.result.pupils_located:
             color = (0, 255, 0)
-            x_left, y_left = self.pupil_left_coords()
-            x_right, y_right = self.pupil_right_coords()
+            x_left, y_left = self.result.pupil_left
+            x_right, y_right = self.result.pupil_right
             cv2.line(frame, (x_left - 5, y_left), (x_left + 5, y_left), color)
             cv2.line(frame, (x_left, y_left - 5), (x_left, y_left + 5), color)
             cv2.line(frame, (x_right - 5, y_right), (x_right + 5, y_right), color)
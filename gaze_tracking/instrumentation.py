@@ -0,0 +1,85 @@
+from __future__ import division
+import bisect
+import numpy as np
+
+# Stages recorded by GazeTracking, in the order they run on a frame
+STAGES = ("detection", "landmarks", "isolate", "calibration", "pupil", "total")
+
+# Upper bounds (in seconds) of the buckets of the duration histograms
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+class StageTimer(object):
+    """
+    This class records the durations of the stages of the pipeline.
+    The last durations of every stage are kept in a fixed size ring buffer,
+    along with a count, a sum and a histogram of all the durations, so
+    recording a duration doesn't allocate anything.
+    """
+
+    def __init__(self, stages=STAGES, size=1024):
+        self.stages = tuple(stages)
+        self.size = size
+        self._indexes = {stage: index for index, stage in enumerate(self.stages)}
+        self.reset()
+
+    def reset(self):
+        """Forgets every recorded duration"""
+        count = len(self.stages)
+        self._durations = np.zeros((count, self.size))
+        self._counts = [0] * count
+        self._sums = [0.0] * count
+        self._histograms = np.zeros((count, len(BUCKETS) + 1), np.int64)
+
+    def record(self, stage, duration):
+        """Records the duration of a stage
+
+        Arguments:
+            stage (str): Name of the stage
+            duration (float): Duration in seconds
+        """
+        index = self._indexes[stage]
+        count = self._counts[index]
+        self._durations[index, count % self.size] = duration
+        self._counts[index] = count + 1
+        self._sums[index] += duration
+        self._histograms[index, bisect.bisect_left(BUCKETS, duration)] += 1
+
+    def count(self, stage):
+        """Returns the number of durations recorded for a stage"""
+        return self._counts[self._indexes[stage]]
+
+    def total(self, stage):
+        """Returns the sum of the durations recorded for a stage, in seconds"""
+        return self._sums[self._indexes[stage]]
+
+    def durations(self, stage):
+        """Returns the last durations of a stage (at most size of them),
+        from the oldest to the newest"""
+        index = self._indexes[stage]
+        count = self._counts[index]
+        if count <= self.size:
+            return self._durations[index, :count].copy()
+        start = count % self.size
+        return np.concatenate((self._durations[index, start:], self._durations[index, :start]))
+
+    def histogram(self, stage):
+        """Returns the histogram of the durations of a stage as a list of
+        (upper bound, cumulative count) pairs. The last upper bound is infinite."""
+        counts = np.cumsum(self._histograms[self._indexes[stage]])
+        bounds = BUCKETS + (float("inf"),)
+        return list(zip(bounds, counts.tolist()))
+
+    def summary(self):
+        """Returns a dictionary stage -> (count, mean, p50, p99) of the durations
+        in seconds. The percentiles are computed over the last durations only."""
+        stats = {}
+        for stage in self.stages:
+            count = self.count(stage)
+            if count == 0:
+                stats[stage] = (0, None, None, None)
+                continue
+            recent = self.durations(stage)
+            stats[stage] = (count, self.total(stage) / count,
+                            float(np.percentile(recent, 50)), float(np.percentile(recent, 99)))
+        return stats
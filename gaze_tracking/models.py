@@ -0,0 +1,37 @@
+import os
+import threading
+import multiprocessing
+import dlib
+
+# Path of the 68 facial landmarks model shipped with the package
+cwd = os.path.abspath(os.path.dirname(__file__))
+LANDMARKS_MODEL_PATH = os.path.abspath(os.path.join(cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
+
+_predictors = {}
+_lock = threading.Lock()
+
+
+def load_predictor(model_path=LANDMARKS_MODEL_PATH):
+    """Returns the shape predictor of a model, loading the model only once per
+    process. A predictor loaded before forking worker processes is inherited by
+    them: its weights are only read, so the workers share the memory pages of
+    the parent (copy-on-write) instead of holding their own copy.
+
+    Argument:
+        model_path (str): Path of the model file
+    """
+    with _lock:
+        predictor = _predictors.get(model_path)
+        if predictor is None:
+            predictor = dlib.shape_predictor(model_path)
+            _predictors[model_path] = predictor
+        return predictor
+
+
+def fork_context():
+    """Returns a multiprocessing context whose workers are forked from the
+    current process, so that they share the predictors already loaded.
+    Falls back to the default context where fork isn't available."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
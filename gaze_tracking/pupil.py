@@ -8,14 +8,35 @@ class Pupil(object):
     the position of the pupil
     """
 
-    def __init__(self, eye_frame, threshold):
+    # Engines used to locate the iris in the binarized frame
+    CONTOURS = "contours"
+    COMPONENTS = "components"
+
+    def __init__(self, eye_frame, threshold, engine=CONTOURS):
         self.iris_frame = None
         self.threshold = threshold
+        self.engine = engine
         self.x = None
         self.y = None
 
         self.detect_iris(eye_frame)
 
+    @staticmethod
+    def filter_frame(eye_frame):
+        """Smooths the eye frame before its binarization
+
+        Argument:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+
+        Returns:
+            The filtered frame, which doesn't depend on the threshold
+        """
+        kernel = np.ones((3, 3), np.uint8)
+        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
+        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+
+        return new_frame
+
     @staticmethod
     def image_processing(eye_frame, threshold):
         """Performs operations on the eye frame to isolate the iris
@@ -27,9 +48,7 @@ class Pupil(object):
         Returns:
             A frame with a single element representing the iris
         """
-        kernel = np.ones((3, 3), np.uint8)
-        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
-        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+        new_frame = Pupil.filter_frame(eye_frame)
         new_frame = cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY)[1]
 
         return new_frame
@@ -43,6 +62,16 @@ class Pupil(object):
         """
         self.iris_frame = self.image_processing(eye_frame, self.threshold)
 
+        if self.engine == self.COMPONENTS:
+            self._locate_with_components()
+        else:
+            self._locate_with_contours()
+
+    def _locate_with_contours(self):
+        """Estimates the position of the pupil from the moments of the
+        second largest contour of the iris frame, which is the iris
+        (the largest one is the border of the frame)
+        """
         contours, _ = cv2.findContours(self.iris_frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
         contours = sorted(contours, key=cv2.contourArea)
 
@@ -52,3 +81,19 @@ class Pupil(object):
             self.y = int(moments['m01'] / moments['m00'])
         except (IndexError, ZeroDivisionError):
             pass
+
+    def _locate_with_components(self):
+        """Estimates the position of the pupil from the centroid of the largest
+        black connected component of the iris frame, which is the iris.
+        It doesn't build the contour hierarchy nor sort the contours.
+        """
+        # Black pixels are 4-connected when the white ones are 8-connected,
+        # which is how the contour engine sees the iris hole
+        inverse = cv2.bitwise_not(self.iris_frame)
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(inverse, connectivity=4)
+        if count < 2:
+            return
+
+        label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+        self.x = int(centroids[label][0])
+        self.y = int(centroids[label][1])
@@ -0,0 +1,10 @@
+from .rate import RateMeter
+from .metrics import Metrics
+from .capture import FrameGrabber
+from .broadcast import Broadcaster, EncodedFrame, Subscription, AsyncBroadcaster, AsyncSubscription
+from .screens import ScreenCache
+from .aserver import AsyncServer, respond, start_stream
+from .websocket import WebSocket, accept
+from .quality import QualityController
+from .pipeline import Pipeline, Stage, Packet
+from .sampler import Sampler
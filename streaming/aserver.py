@@ -0,0 +1,123 @@
+import asyncio
+from urllib.parse import urlsplit, parse_qs
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           503: "Service Unavailable"}
+
+
+class Request(object):
+    """
+    This class holds a request received by AsyncServer, with the streams
+    of its connection.
+    """
+
+    def __init__(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = parse_qs(url.query)
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+
+
+class AsyncServer(object):
+    """
+    This class is a small asyncio HTTP server. Every client is a coroutine
+    instead of a thread, so many viewers can stream at once on a small
+    device. The handlers are coroutines taking a Request and writing their
+    response with respond() or start_stream().
+
+    Arguments:
+        max_header_size (int): Maximum size of the request line and headers
+    """
+
+    def __init__(self, max_header_size=16384):
+        self.max_header_size = max_header_size
+        self._routes = {}
+
+    def route(self, path):
+        """Decorator registering the handler of a path"""
+        def decorator(handler):
+            self._routes[path] = handler
+            return handler
+        return decorator
+
+    async def _handle(self, reader, writer):
+        """Reads a request and calls the handler of its path"""
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, _ = lines[0].split(" ", 2)
+            except ValueError:
+                await respond(writer, 400, b"Bad request")
+                return
+
+            headers = {}
+            for line in lines[1:]:
+                name, separator, value = line.partition(":")
+                if separator:
+                    headers[name.strip().lower()] = value.strip()
+
+            request = Request(method, target, headers, reader, writer)
+            handler = self._routes.get(request.path)
+            if handler is None:
+                await respond(writer, 404, b"Not found")
+            elif method not in ("GET", "HEAD"):
+                await respond(writer, 405, b"Method not allowed")
+            else:
+                await handler(request)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="0.0.0.0", port=5000):
+        """Serves the routes until cancelled"""
+        server = await asyncio.start_server(self._handle, host, port, limit=self.max_header_size)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host="0.0.0.0", port=5000):
+        """Serves the routes, blocking until interrupted"""
+        asyncio.run(self.serve(host, port))
+
+
+def _head(status, content_type, extra=None):
+    """Returns the status line and headers of a response"""
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+             "Cache-Control: no-cache", "Connection: close"]
+    for name, value in (extra or {}).items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+
+async def respond(writer, status, body, content_type="text/plain; charset=utf-8"):
+    """Writes a complete response
+
+    Arguments:
+        writer (asyncio.StreamWriter): Stream of the connection
+        status (int): HTTP status code
+        body (bytes or str): Body of the response
+        content_type (str): Content type of the body
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    writer.write(_head(status, content_type, {"Content-Length": len(body)}) + b"\r\n" + body)
+    await writer.drain()
+
+
+async def start_stream(writer, content_type):
+    """Writes the head of a response whose body is streamed afterwards
+
+    Arguments:
+        writer (asyncio.StreamWriter): Stream of the connection
+        content_type (str): Content type of the body
+    """
+    writer.write(_head(200, content_type) + b"\r\n")
+    await writer.drain()
@@ -0,0 +1,295 @@
+import time
+import asyncio
+import threading
+from collections import deque
+import cv2
+
+
+class EncodedFrame(object):
+    """
+    This class holds a processed and encoded frame shared by all the clients.
+    When the processed frame is kept, it can also be encoded at other
+    qualities and scales for the clients of a lighter stream.
+
+    Arguments:
+        sequence (int): Sequence number of the camera frame
+        timestamp (float): Time the camera frame was captured (time.monotonic())
+        jpeg (bytes): JPEG encoded frame, None to encode the processed frame
+            later with encode()
+        frame (numpy.ndarray): Processed frame, to encode the other variants
+        quality (int): JPEG quality of jpeg
+    """
+
+    __slots__ = ("sequence", "timestamp", "jpeg", "frame", "quality", "_variants", "_lock")
+
+    def __init__(self, sequence, timestamp, jpeg, frame=None, quality=None):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.jpeg = jpeg
+        self.frame = frame
+        self.quality = quality
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def encode(self):
+        """Encodes the processed frame at its quality if the frame was created
+        without its JPEG, so the encoding can run on another thread (like a
+        Pipeline stage) than the processing. Returns the frame itself."""
+        if self.jpeg is None:
+            _, buffer = cv2.imencode('.jpg', self.frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            self.jpeg = buffer.tobytes()
+        return self
+
+    def _key(self, quality, scale):
+        """Returns the cache key of a variant, None for the JPEG given at creation"""
+        if self.frame is None or ((quality is None or quality == self.quality) and scale == 1.0):
+            return None
+        return quality, scale
+
+    def is_encoded(self, quality=None, scale=1.0):
+        """Returns true if the variant doesn't need to be encoded anymore
+
+        Arguments:
+            quality (int): JPEG quality (quality of jpeg by default)
+            scale (float): Scale of the output resolution
+        """
+        key = self._key(quality, scale)
+        return key is None or key in self._variants
+
+    def variant(self, quality=None, scale=1.0):
+        """Returns the frame encoded at the given quality and scale, encoded
+        once for all the clients asking for the same variant. Frames created
+        without their processed frame always return their JPEG.
+
+        Arguments:
+            quality (int): JPEG quality (quality of jpeg by default)
+            scale (float): Scale of the output resolution
+        """
+        key = self._key(quality, scale)
+        if key is None:
+            return self.jpeg
+
+        with self._lock:
+            jpeg = self._variants.get(key)
+            if jpeg is None:
+                frame = self.frame
+                if scale != 1.0:
+                    frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                quality = self.quality if quality is None else quality
+                _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+                jpeg = self._variants[key] = buffer.tobytes()
+        return jpeg
+
+    def multipart(self, quality=None, scale=1.0):
+        """Returns a variant of the frame as a part of a multipart/x-mixed-replace
+        stream, built once for all the clients
+
+        Arguments:
+            quality (int): JPEG quality (quality of jpeg by default)
+            scale (float): Scale of the output resolution
+        """
+        key = ("multipart", self._key(quality, scale))
+        part = self._variants.get(key)
+        if part is None:
+            part = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + self.variant(quality, scale) + b'\r\n'
+            self._variants[key] = part
+        return part
+
+
+class Subscription(object):
+    """
+    This class is the bounded queue of a client of a Broadcaster. When the
+    client falls behind, the oldest frames are dropped.
+
+    Arguments:
+        size (int): Maximum number of frames waiting for the client
+    """
+
+    def __init__(self, size=2):
+        self.dropped = 0
+        self._items = deque(maxlen=size)
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        """Adds an item, dropping the oldest one if the queue is full.
+        Returns true if an item was dropped."""
+        with self._condition:
+            dropped = len(self._items) == self._items.maxlen
+            if dropped:
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify()
+        return dropped
+
+    def get(self, timeout=None):
+        """Returns the oldest item, waiting for one until the timeout.
+        Returns None if there is none.
+
+        Argument:
+            timeout (float): Maximum waiting time in seconds (no limit by default)
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+
+class Broadcaster(object):
+    """
+    This class runs a single producer in a background thread and fans every
+    item it produces out to all the subscribers, so the work done for an item
+    (capture, processing, encoding) doesn't depend on the number of clients.
+
+    Arguments:
+        produce (callable): Returns the next item (blocking until it is ready),
+            or None when there is nothing to publish
+        queue_size (int): Maximum number of items waiting for a subscriber
+        metrics (streaming.Metrics): Counts the items dropped for slow subscribers
+    """
+
+    def __init__(self, produce, queue_size=2, metrics=None):
+        self.produce = produce
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts the producer thread, if it isn't running yet"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def subscribe(self):
+        """Returns a new Subscription receiving the next items.
+        Starts the producer thread if needed."""
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        self.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops sending items to a subscription"""
+        with self._lock:
+            self._subscriptions = [other for other in self._subscriptions if other is not subscription]
+
+    def publish(self, item):
+        """Sends an item to every subscriber"""
+        # The list is replaced (never modified) on subscription changes,
+        # so it can be iterated without holding the lock
+        for subscription in self._subscriptions:
+            if subscription.put(item) and self.metrics is not None:
+                self.metrics.count("client_frames_dropped")
+
+    def _run(self):
+        """Produces and publishes items forever"""
+        while True:
+            try:
+                item = self.produce()
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.count("producer_errors")
+                time.sleep(0.01)
+                continue
+            if item is not None:
+                self.publish(item)
+
+
+class AsyncSubscription(object):
+    """
+    This class is the bounded queue of a client of an AsyncBroadcaster.
+    When the client falls behind, the oldest frames are dropped.
+
+    Arguments:
+        size (int): Maximum number of frames waiting for the client
+    """
+
+    def __init__(self, size=2):
+        self.dropped = 0
+        self._items = deque(maxlen=size)
+        self._event = asyncio.Event()
+
+    def put(self, item):
+        """Adds an item, dropping the oldest one if the queue is full.
+        Returns true if an item was dropped."""
+        dropped = len(self._items) == self._items.maxlen
+        if dropped:
+            self.dropped += 1
+        self._items.append(item)
+        self._event.set()
+        return dropped
+
+    async def get(self):
+        """Returns the oldest item, waiting for one"""
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popleft()
+
+
+class AsyncBroadcaster(object):
+    """
+    This class is the asyncio version of Broadcaster. The producer runs in an
+    executor, so the CPU-heavy work (gaze tracking, encoding) doesn't block the
+    event loop, and every item is fanned out to the subscribers of the loop.
+
+    Arguments:
+        produce (callable): Returns the next item (blocking until it is ready),
+            or None when there is nothing to publish
+        executor (concurrent.futures.Executor): Runs the producer. The default
+            executor of the loop when not given
+        queue_size (int): Maximum number of items waiting for a subscriber
+        metrics (streaming.Metrics): Counts the items dropped for slow subscribers
+    """
+
+    def __init__(self, produce, executor=None, queue_size=2, metrics=None):
+        self.produce = produce
+        self.executor = executor
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self._subscriptions = []
+        self._task = None
+
+    def subscribe(self, subscription=None):
+        """Returns a new AsyncSubscription receiving the next items.
+        Starts the producer task if needed.
+
+        Argument:
+            subscription (AsyncSubscription): Subscription to register, for example
+                with a different size. A new one of queue_size by default
+        """
+        if subscription is None:
+            subscription = AsyncSubscription(self.queue_size)
+        self._subscriptions.append(subscription)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops sending items to a subscription"""
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def publish(self, item):
+        """Sends an item to every subscriber"""
+        for subscription in self._subscriptions:
+            if subscription.put(item) and self.metrics is not None:
+                self.metrics.count("client_frames_dropped")
+
+    async def _run(self):
+        """Produces and publishes items forever"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await loop.run_in_executor(self.executor, self.produce)
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.count("producer_errors")
+                await asyncio.sleep(0.01)
+                continue
+            if item is not None:
+                self.publish(item)
@@ -0,0 +1,92 @@
+import time
+import threading
+
+
+class FrameGrabber(object):
+    """
+    This class drains a camera in a background thread and keeps only the
+    latest frame, so the processing always works on the freshest frame
+    instead of on frames buffered by the camera. Frames replaced before
+    anyone read them are counted as dropped.
+
+    Arguments:
+        capture (cv2.VideoCapture): Camera to read, or any object with a read()
+            method returning (success, frame)
+        metrics (streaming.Metrics): Receives the capture rate, latency and
+            dropped frames when given
+    """
+
+    def __init__(self, capture, metrics=None):
+        self.capture = capture
+        self.metrics = metrics
+        self.dropped = 0
+        self._frame = None
+        self._timestamp = None
+        self._sequence = 0
+        self._last_read = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Starts the capture thread, if it isn't running yet"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the capture thread"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Reads the camera until the grabber is stopped"""
+        while self._running:
+            start = time.perf_counter()
+            success, frame = self.capture.read()
+            if self.metrics is not None:
+                self.metrics.record("capture", time.perf_counter() - start)
+
+            if not success:
+                if self.metrics is not None:
+                    self.metrics.count("capture_errors")
+                time.sleep(0.01)
+                continue
+
+            with self._condition:
+                if self._sequence > self._last_read:
+                    self.dropped += 1
+                    if self.metrics is not None:
+                        self.metrics.count("frames_dropped")
+                self._frame = frame
+                self._timestamp = time.monotonic()
+                self._sequence += 1
+                self._condition.notify_all()
+
+            if self.metrics is not None:
+                self.metrics.tick("camera")
+
+    def read(self, after=0, timeout=1.0):
+        """Returns the latest frame as a (sequence, timestamp, frame) tuple, waiting
+        for a frame newer than the given sequence number. Returns None if no new
+        frame arrives before the timeout. Starts the capture thread if needed.
+
+        Arguments:
+            after (int): Sequence number of the last frame read by the caller
+            timeout (float): Maximum waiting time in seconds
+        """
+        self.start()
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence > after or not self._running, timeout):
+                return None
+            if self._sequence <= after:
+                return None
+            self._last_read = max(self._last_read, self._sequence)
+            return self._sequence, self._timestamp, self._frame
@@ -0,0 +1,127 @@
+from __future__ import division
+import threading
+from gaze_tracking import StageTimer
+from .rate import RateMeter
+
+# Stages of the video pipeline timed by Metrics
+PIPELINE_STAGES = ("capture", "detect", "render", "encode")
+
+
+class Metrics(object):
+    """
+    This class keeps the counters of the video pipeline (frame rates,
+    stage latencies, dropped frames, bytes sent to every client) and
+    exports them in the Prometheus text format.
+
+    Arguments:
+        timers (list): Other StageTimer instances whose stages are exported
+            along with the pipeline stages, like the timer of GazeTracking
+        prefix (str): Prefix of the names of the metrics
+    """
+
+    def __init__(self, timers=(), prefix="mechart"):
+        self.prefix = prefix
+        self.timer = StageTimer(PIPELINE_STAGES)
+        self._timers = [self.timer] + list(timers)
+        self._rates = {"camera": RateMeter()}
+        self._counters = {}
+        self._gauges = {}
+        self._clients = {}
+        self._next_client = 0
+        self._lock = threading.Lock()
+
+    def tick(self, name):
+        """Records a frame for the frame rate of the given name (like "camera")"""
+        self._rates[name].tick()
+
+    def rate(self, name):
+        """Returns the frame rate of the given name (like "camera" or a pipeline stage)"""
+        return self._rates[name].rate()
+
+    def add_rates(self, meters):
+        """Exports the frame rates of other RateMeter instances, like the
+        stages of a streaming.Pipeline
+
+        Argument:
+            meters (dict): RateMeter instances by name
+        """
+        self._rates.update(meters)
+
+    def record(self, stage, duration):
+        """Records the duration (in seconds) of a pipeline stage. Stages
+        other than PIPELINE_STAGES aren't timed."""
+        if stage not in self.timer.stages:
+            return
+        with self._lock:
+            self.timer.record(stage, duration)
+
+    def count(self, name, value=1):
+        """Increments a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """Sets the value of a gauge"""
+        self._gauges[name] = value
+
+    def add_client(self):
+        """Registers a new streaming client and returns its id"""
+        with self._lock:
+            self._next_client += 1
+            self._clients[self._next_client] = 0
+            return self._next_client
+
+    def remove_client(self, client):
+        """Forgets a disconnected streaming client"""
+        with self._lock:
+            self._clients.pop(client, None)
+
+    def sent(self, client, nb_bytes):
+        """Records bytes sent to a client"""
+        with self._lock:
+            if client in self._clients:
+                self._clients[client] += nb_bytes
+            self._counters["bytes_sent"] = self._counters.get("bytes_sent", 0) + nb_bytes
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = []
+        prefix = self.prefix
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        for name, meter in self._rates.items():
+            family(f"{name}_fps", "gauge", f"Frames per second of the {name} stage")
+            lines.append(f"{prefix}_{name}_fps {meter.rate():.3f}")
+
+        with self._lock:
+            counters = dict(self._counters)
+            clients = dict(self._clients)
+            histograms = [(stage, timer.histogram(stage), timer.total(stage), timer.count(stage))
+                          for timer in self._timers for stage in timer.stages]
+
+        for name, value in sorted(counters.items()):
+            family(f"{name}_total", "counter", f"Total number of {name.replace('_', ' ')}")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        for name, value in sorted(self._gauges.items()):
+            family(name, "gauge", f"Current value of {name.replace('_', ' ')}")
+            lines.append(f"{prefix}_{name} {float(value)}")
+
+        family("clients", "gauge", "Number of connected streaming clients")
+        lines.append(f"{prefix}_clients {len(clients)}")
+        family("client_bytes_sent_total", "counter", "Bytes sent to every connected streaming client")
+        for client, value in sorted(clients.items()):
+            lines.append(f'{prefix}_client_bytes_sent_total{{client="{client}"}} {value}')
+
+        family("stage_latency_seconds", "histogram", "Latency of the stages of the pipeline")
+        for stage, buckets, total, count in histograms:
+            for bound, cumulative in buckets:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_stage_latency_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_latency_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{prefix}_stage_latency_seconds_count{{stage="{stage}"}} {count}')
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+import time
+import queue
+import threading
+from collections import deque
+from .rate import RateMeter
+from .broadcast import Subscription
+
+
+class Packet(object):
+    """
+    This class carries a camera frame through the stages of a Pipeline.
+    The stages attach their results to it as attributes.
+
+    Arguments:
+        sequence (int): Sequence number of the camera frame
+        timestamp (float): Time the camera frame was captured (time.monotonic())
+        frame (numpy.ndarray): Camera frame
+    """
+
+    def __init__(self, sequence, timestamp, frame):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.frame = frame
+
+
+class Stage(object):
+    """
+    This class describes a stage of a Pipeline.
+
+    Arguments:
+        name (str): Name of the stage in the metrics
+        function (callable): For the first stage, returns the next item (blocking
+            until it is ready) or None when there is none. For the other stages,
+            takes the item of the previous stage and returns the item passed to
+            the next one, or None to drop it
+        workers (int): Number of threads running the function. With several
+            threads, the items are still passed on in order
+    """
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+
+class Pipeline(object):
+    """
+    This class runs every stage of a video pipeline (like capture, detection,
+    rendering and encoding) on its own worker. The stages are linked by bounded
+    queues dropping their oldest item when the next stage falls behind, so the
+    frame rate is set by the slowest stage instead of the sum of all the stages,
+    and the frames stay fresh.
+
+    Arguments:
+        stages (list): Stage instances, the first one is the source
+        queue_size (int): Maximum number of items waiting between two stages
+            (at least the number of threads of the stage before)
+        metrics (streaming.Metrics): Receives the throughput and the latency of
+            every stage, the dropped items and the errors when given
+    """
+
+    def __init__(self, stages, queue_size=2, metrics=None):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.meters = {stage.name: RateMeter() for stage in self.stages}
+        if metrics is not None:
+            metrics.add_rates(self.meters)
+        # The queue following every stage, the last one holds the output. A stage
+        # running on several threads can pass on as many items at once
+        self._queues = [Subscription(max(queue_size, stage.workers)) for stage in self.stages]
+        self._lock = threading.Lock()
+        self._threads = None
+
+    def start(self):
+        """Starts the workers of the stages, if they aren't running yet"""
+        with self._lock:
+            if self._threads is not None:
+                return
+            self._threads = [threading.Thread(target=self._run, args=(index,), daemon=True)
+                             for index in range(len(self.stages))]
+        for thread in self._threads:
+            thread.start()
+
+    def _call(self, stage, item=None):
+        """Runs the function of a stage on an item (without argument for the
+        source), returns None if it failed"""
+        start = time.perf_counter()
+        try:
+            result = stage.function() if item is None else stage.function(item)
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.count(f"{stage.name}_errors")
+            # Don't spin on a failing source
+            if item is None:
+                time.sleep(0.01)
+            return None
+        # The source mostly waits for its items, only the other stages are timed
+        if item is not None and self.metrics is not None:
+            self.metrics.record(stage.name, time.perf_counter() - start)
+        return result
+
+    def _forward(self, index, item):
+        """Passes the item of a stage to the next one"""
+        if item is None:
+            return
+        self.meters[self.stages[index].name].tick()
+        if self._queues[index].put(item) and self.metrics is not None:
+            following = self.stages[index + 1].name if index + 1 < len(self.stages) else "output"
+            self.metrics.count(f"{following}_frames_dropped")
+
+    def _run(self, index):
+        """Runs a stage forever"""
+        stage = self.stages[index]
+        if index == 0:
+            while True:
+                self._forward(index, self._call(stage))
+        elif stage.workers == 1:
+            while True:
+                item = self._queues[index - 1].get(timeout=1.0)
+                if item is not None:
+                    self._forward(index, self._call(stage, item))
+        else:
+            self._run_pool(index)
+
+    def _run_pool(self, index):
+        """Runs a stage on several threads, passing the items on in order"""
+        stage = self.stages[index]
+        source = self._queues[index - 1]
+        jobs = queue.Queue()
+        # [result, done] slots, in the order of the items
+        pending = deque()
+        condition = threading.Condition()
+
+        def work():
+            while True:
+                item, slot = jobs.get()
+                slot[0] = self._call(stage, item)
+                with condition:
+                    slot[1] = True
+                    # Only the oldest items are passed on
+                    while pending and pending[0][1]:
+                        self._forward(index, pending.popleft()[0])
+                    if self.metrics is not None:
+                        self.metrics.set(f"{stage.name}_queue_depth", len(pending))
+                    condition.notify_all()
+
+        for _ in range(stage.workers):
+            threading.Thread(target=work, daemon=True).start()
+
+        while True:
+            item = source.get(timeout=1.0)
+            if item is None:
+                continue
+            slot = [None, False]
+            with condition:
+                condition.wait_for(lambda: len(pending) < stage.workers * 2)
+                pending.append(slot)
+            jobs.put((item, slot))
+
+    def get(self, timeout=1.0):
+        """Returns the next output item of the pipeline, waiting for it until the
+        timeout. Returns None if there is none. Starts the workers if needed.
+
+        Argument:
+            timeout (float): Maximum waiting time in seconds
+        """
+        self.start()
+        item = self._queues[-1].get(timeout)
+        if item is not None and self.metrics is not None:
+            self.metrics.set("pipeline_latency_seconds", time.monotonic() - item.timestamp)
+        return item
+
+    def rates(self):
+        """Returns a dictionary stage -> items passed on per second"""
+        return {name: meter.rate() for name, meter in self.meters.items()}
@@ -0,0 +1,96 @@
+from __future__ import division
+import time
+from .rate import RateMeter
+
+# (JPEG quality, output scale) levels, from the best image to the lightest stream.
+# The levels are shared by all the clients, so the clients on the same level
+# share the same encoded frames
+LEVELS = ((80, 1.0), (70, 1.0), (60, 1.0), (50, 0.75), (40, 0.75), (40, 0.5), (30, 0.5))
+
+
+class QualityController(object):
+    """
+    This class adapts the JPEG quality and the output scale of the stream of
+    a client to its throughput. When the client receives fewer frames than
+    the target rate, the image is degraded by one level. After a few intervals
+    at the target rate, the image is improved by one level again, and the wait
+    doubles each time the improved level can't be kept. A congested network
+    then lowers the image quality instead of the frame rate.
+
+    Arguments:
+        target_fps (float): Frame rate to keep for the client
+        levels (tuple): (quality, scale) levels, from the best to the lightest
+        interval (float): Seconds between two adjustments
+        tolerance (float): Fraction of the target rate considered on target
+        recovery (int): Intervals on target before improving the image
+    """
+
+    def __init__(self, target_fps=15.0, levels=LEVELS, interval=1.0, tolerance=0.85, recovery=3):
+        self.target_fps = target_fps
+        self.levels = levels
+        self.interval = interval
+        self.tolerance = tolerance
+        self.recovery = recovery
+        self.index = 0
+        self.meter = RateMeter(window=interval * 2)
+        self._on_target = 0
+        self._wait = recovery
+        self._improved = False
+        self._last_update = None
+
+    @property
+    def level(self):
+        """Returns the current (quality, scale) level"""
+        return self.levels[self.index]
+
+    def tick(self, now=None):
+        """Records a frame sent to the client
+
+        Argument:
+            now (float): Time of the frame (time.monotonic() by default)
+        """
+        self.meter.tick(now)
+
+    def update(self, offered=None, rate=None, now=None):
+        """Adjusts the level once per interval. Returns -1 when the image was
+        degraded, 1 when it was improved, 0 otherwise.
+
+        Arguments:
+            offered (float): Frame rate the source produces, when it is below the
+                target the client can't do better than this rate
+            rate (float): Frame rate received by the client, measured from the
+                frames passed to tick() by default
+            now (float): Current time (time.monotonic() by default)
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_update is None:
+            self._last_update = now
+        if now - self._last_update < self.interval:
+            return 0
+        self._last_update = now
+
+        if rate is None:
+            rate = self.meter.rate(now)
+        target = self.target_fps if offered is None else min(self.target_fps, offered)
+
+        if rate < target * self.tolerance:
+            self._on_target = 0
+            if self._improved:
+                self._wait = min(self._wait * 2, self.recovery * 16)
+                self._improved = False
+            if self.index < len(self.levels) - 1:
+                self.index += 1
+                return -1
+            return 0
+
+        # The improved level is kept once it stayed on target for a whole recovery
+        self._on_target += 1
+        if self._improved and self._on_target >= self.recovery:
+            self._wait = self.recovery
+            self._improved = False
+        if self._on_target >= self._wait and self.index > 0:
+            self._on_target = 0
+            self._improved = True
+            self.index -= 1
+            return 1
+        return 0
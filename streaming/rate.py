@@ -0,0 +1,38 @@
+from __future__ import division
+import time
+import threading
+from collections import deque
+
+
+class RateMeter(object):
+    """
+    This class measures the rate of an event (like frames per second)
+    over a sliding time window.
+    """
+
+    def __init__(self, window=2.0, size=256):
+        self.window = window
+        self._times = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def tick(self, now=None):
+        """Records an occurrence of the event
+
+        Argument:
+            now (float): Time of the event (time.monotonic() by default)
+        """
+        with self._lock:
+            self._times.append(time.monotonic() if now is None else now)
+
+    def rate(self, now=None):
+        """Returns the number of events per second over the window
+
+        Argument:
+            now (float): Current time (time.monotonic() by default)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            times = [t for t in self._times if now - t <= self.window]
+        if len(times) < 2 or now <= times[0]:
+            return 0.0
+        return (len(times) - 1) / (now - times[0])
@@ -0,0 +1,71 @@
+import time
+import threading
+from .rate import RateMeter
+
+
+class Sampler(object):
+    """
+    This class runs a slow analysis (like the gaze detection) in a background
+    thread on the latest item submitted, at most max_rate times per second,
+    and keeps its latest result. The items submitted while the analysis runs
+    are replaced by newer ones, so the callers never wait for the analysis.
+
+    Arguments:
+        function (callable): Analyzes an item and returns the result
+        max_rate (float): Maximum number of analyses per second (0 for as
+            fast as possible)
+        metrics (streaming.Metrics): Receives the rate of the analysis and
+            its errors when given
+        name (str): Name of the analysis in the metrics
+    """
+
+    def __init__(self, function, max_rate=0, metrics=None, name="analysis"):
+        self.function = function
+        self.max_rate = max_rate
+        self.metrics = metrics
+        self.name = name
+        self.meter = RateMeter()
+        if metrics is not None:
+            metrics.add_rates({name: self.meter})
+        self._item = None
+        self._result = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """Starts the analysis thread, if it isn't running yet"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Gives the next item to analyze, replacing the one waiting if any.
+        Starts the analysis thread if needed."""
+        with self._condition:
+            self._item = item
+            self._condition.notify()
+        self.start()
+
+    def latest(self):
+        """Returns the result of the last analysis, None before the first one"""
+        return self._result
+
+    def _run(self):
+        """Analyzes the items forever"""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._item is not None)
+                item, self._item = self._item, None
+
+            start = time.monotonic()
+            try:
+                self._result = self.function(item)
+                self.meter.tick()
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.count(f"{self.name}_errors")
+
+            if self.max_rate:
+                time.sleep(max(0, start + 1.0 / self.max_rate - time.monotonic()))
@@ -0,0 +1,51 @@
+import threading
+import cv2
+
+
+class ScreenCache(object):
+    """
+    This class renders and JPEG encodes static screens (like the phrase
+    screens) once, so they can be streamed again without drawing nor
+    encoding them on every frame.
+
+    Arguments:
+        render (callable): Draws the screen of a key, called as
+            render(key, width, height) and returning a BGR frame
+        quality (int): JPEG quality of the encoded screens
+    """
+
+    def __init__(self, render, quality=80):
+        self.render = render
+        self.quality = quality
+        self._jpegs = {}
+        self._lock = threading.Lock()
+
+    def jpeg(self, key, width, height):
+        """Returns the encoded screen of a key at the given resolution,
+        rendering it the first time only
+
+        Arguments:
+            key: Identifies the screen
+            width (int): Width of the screen
+            height (int): Height of the screen
+        """
+        cache_key = (key, width, height, self.quality)
+        jpeg = self._jpegs.get(cache_key)
+        if jpeg is None:
+            frame = self.render(key, width, height)
+            _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            jpeg = buffer.tobytes()
+            with self._lock:
+                self._jpegs[cache_key] = jpeg
+        return jpeg
+
+    def prerender(self, keys, width, height):
+        """Renders and encodes the screens of several keys in advance
+
+        Arguments:
+            keys (iterable): Keys of the screens
+            width (int): Width of the screens
+            height (int): Height of the screens
+        """
+        for key in keys:
+            self.jpeg(key, width, height)
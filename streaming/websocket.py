@@ -0,0 +1,133 @@
+import base64
+import hashlib
+import struct
+import asyncio
+from .aserver import respond
+
+# Defined by RFC 6455 to compute the handshake answer
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Close status of a message too large to be processed
+STATUS_TOO_BIG = 1009
+
+# Largest payloads accepted from a client: control frames are limited by
+# RFC 6455, and the messages of the clients are only acknowledgements
+MAX_CONTROL_SIZE = 125
+MAX_MESSAGE_SIZE = 1024
+
+
+class MessageTooBig(Exception):
+    """Raised when a client announces a frame larger than accepted"""
+
+
+class WebSocket(object):
+    """
+    This class is the server side of a WebSocket connection (RFC 6455)
+    opened on a request of AsyncServer. It sends binary messages, counts
+    the messages of the client (used as acknowledgements) and answers its
+    control frames.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.received = 0
+        self.closed = asyncio.Event()
+        self._message = asyncio.Event()
+
+    @staticmethod
+    def _frame(opcode, payload):
+        """Returns an unmasked frame carrying the whole payload"""
+        length = len(payload)
+        if length < 126:
+            head = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            head = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        return head + payload
+
+    async def send(self, payload):
+        """Sends a binary message and waits until it is handed to the network"""
+        self.writer.write(self._frame(OPCODE_BINARY, payload))
+        await self.writer.drain()
+
+    async def _receive(self):
+        """Reads a frame of the client and returns its (opcode, payload).
+        Raises MessageTooBig before reading a payload larger than accepted."""
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", await self.reader.readexactly(8))[0]
+        if length > (MAX_CONTROL_SIZE if first & 0x0F >= OPCODE_CLOSE else MAX_MESSAGE_SIZE):
+            raise MessageTooBig()
+
+        mask = await self.reader.readexactly(4) if second & 0x80 else None
+        payload = await self.reader.readexactly(length)
+        if mask is not None:
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+        return first & 0x0F, payload
+
+    async def wait_received(self, count):
+        """Waits until the client sent at least the given number of messages,
+        or closed the connection
+
+        Argument:
+            count (int): Number of messages to wait for
+        """
+        while self.received < count and not self.closed.is_set():
+            self._message.clear()
+            await self._message.wait()
+
+    async def listen(self):
+        """Counts the messages of the client and answers its pings until
+        it closes the connection. The content of the messages is ignored.
+        The connection is dropped if the client sends a frame too large."""
+        try:
+            while True:
+                opcode, payload = await self._receive()
+                if opcode < OPCODE_CLOSE:
+                    self.received += 1
+                    self._message.set()
+                elif opcode == OPCODE_PING:
+                    self.writer.write(self._frame(OPCODE_PONG, payload))
+                elif opcode == OPCODE_CLOSE:
+                    self.writer.write(self._frame(OPCODE_CLOSE, payload[:2]))
+                    break
+        except MessageTooBig:
+            self.writer.write(self._frame(OPCODE_CLOSE, struct.pack(">H", STATUS_TOO_BIG)))
+            self.writer.close()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.closed.set()
+            self._message.set()
+
+
+async def accept(request):
+    """Completes the WebSocket handshake of a request of AsyncServer.
+    Returns the WebSocket, or None after answering 400 if the request
+    isn't a WebSocket upgrade.
+
+    Argument:
+        request (aserver.Request): Request of the client
+    """
+    key = request.headers.get("sec-websocket-key")
+    if request.headers.get("upgrade", "").lower() != "websocket" or not key:
+        await respond(request.writer, 400, b"Expected a WebSocket upgrade")
+        return None
+
+    answer = base64.b64encode(hashlib.sha1((key + GUID).encode("ascii")).digest()).decode("ascii")
+    request.writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {answer}\r\n\r\n").encode("latin-1"))
+    await request.writer.drain()
+    return WebSocket(request.reader, request.writer)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+# The gaze_tracking package imports dlib
+pytest.importorskip("dlib")
+
+from gaze_tracking.calibration import Calibration
+
+
+def test_closed_eye_is_not_evaluated():
+    # The landmarks of a closed eye sit on one row: only the margins are left
+    calibration = Calibration()
+    calibration.evaluate(np.full((10, 40), 255, np.uint8), 0)
+    assert Calibration.find_best_threshold(np.full((10, 40), 255, np.uint8)) is None
+    assert list(calibration.thresholds_left) == []
+
+
+def test_open_eye_is_evaluated():
+    calibration = Calibration()
+    frame = np.full((30, 50), 200, np.uint8)
+    frame[10:20, 20:30] = 40
+    calibration.evaluate(frame, 1)
+    assert len(calibration.thresholds_right) == 1
@@ -0,0 +1,17 @@
+import pytest
+
+# The gaze_tracking package imports dlib
+pytest.importorskip("dlib")
+
+from gaze_tracking.benchmark import synthetic_gaze, replay, REPLAY_RATES, REPLAY_NOISES
+from gaze_tracking.filters import create_filter
+
+
+@pytest.mark.parametrize("rate", REPLAY_RATES)
+@pytest.mark.parametrize("noise", REPLAY_NOISES)
+def test_one_euro_triggers_sooner_without_more_jitter(rate, noise):
+    signal, truth, timestamps = synthetic_gaze(rate, noise=noise, seed=1)
+    latency, jitter = replay(create_filter("one_euro", rate), signal, truth, timestamps)
+    reference_latency, reference_jitter = replay(create_filter("exponential", rate), signal, truth, timestamps)
+    assert latency < reference_latency
+    assert jitter <= reference_jitter
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+# The gaze_tracking package imports dlib
+dlib = pytest.importorskip("dlib")
+
+from gaze_tracking import gaze_tracking
+from gaze_tracking import GazeTracking
+
+
+def test_background_loading_error_is_exposed(monkeypatch):
+    def load_predictor(model_path):
+        raise OSError("model not found")
+
+    monkeypatch.setattr(gaze_tracking, "load_predictor", load_predictor)
+    gaze = GazeTracking(background_loading=True)
+    with pytest.raises(OSError):
+        gaze.wait_ready(5)
+    assert not gaze.ready
+    assert str(gaze.loading_error) == "model not found"
+
+
+class StillFace(object):
+    """Stands in for the detector and the landmarks model: the face is found on
+    the whole frame, and in its region only if it stayed there"""
+
+    def __init__(self, stayed):
+        self.stayed = stayed
+        self.detections = 0
+
+    def detect(self, frame):
+        if frame.shape[:2] == (480, 640):
+            self.detections += 1
+            return [dlib.rectangle(200, 120, 440, 360)]
+        return [dlib.rectangle(10, 10, 90, 90)] if self.stayed else []
+
+    def predict(self, frame, face):
+        return self
+
+    def parts(self):
+        # Face outline, with the eyes on points 36 to 47
+        points = [(200 + 240 * x // 8, 120 + 240 * y // 8) for y in range(1, 8) for x in range(1, 8)][:68]
+        points += [(320, 300)] * (68 - len(points))
+        for first, x in ((36, 270), (42, 370)):
+            points[first:first + 6] = [(x - 20, 200), (x - 7, 193), (x + 7, 193),
+                                       (x + 20, 200), (x + 7, 207), (x - 7, 207)]
+        return [dlib.point(x, y) for x, y in points]
+
+
+@pytest.mark.parametrize("stayed, detections", [(True, 1), (False, 5)])
+def test_tracking_detects_again_when_the_face_left(stayed, detections):
+    face = StillFace(stayed)
+    gaze = GazeTracking(face_tracking=True, face_detector=face.detect, predictor=face.predict)
+    for _ in range(5):
+        gaze.refresh(np.zeros((480, 640, 3), np.uint8))
+    assert face.detections == detections
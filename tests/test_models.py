@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pytest
+
+# The gaze_tracking package imports dlib
+dlib = pytest.importorskip("dlib")
+
+from gaze_tracking.models import LANDMARKS_MODEL_PATH, load_predictor, fork_context
+
+NB_WORKERS = 4
+
+
+def proportional_size(pid):
+    """Returns the proportional set size (Pss) of a process in bytes: its private
+    memory plus its share of the pages shared with other processes"""
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    raise ValueError("no Pss in smaps_rollup")
+
+
+def predict(ready, done):
+    """Runs the inherited predictor once, then waits until the memory is measured"""
+    frame = np.zeros((100, 100), np.uint8)
+    load_predictor()(frame, dlib.rectangle(0, 0, 99, 99))
+    ready.set()
+    done.wait(30)
+
+
+@pytest.mark.skipif(not os.path.exists(LANDMARKS_MODEL_PATH), reason="landmarks model not downloaded")
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="needs /proc/<pid>/smaps_rollup")
+def test_forked_workers_share_the_model():
+    context = fork_context()
+    if context.get_start_method() != "fork":
+        pytest.skip("fork isn't available")
+
+    load_predictor()
+    done = context.Event()
+    workers = []
+    try:
+        for _ in range(NB_WORKERS):
+            ready = context.Event()
+            worker = context.Process(target=predict, args=(ready, done), daemon=True)
+            worker.start()
+            assert ready.wait(30)
+            workers.append(worker)
+
+        # Copied weights would make every worker count a whole model
+        model_size = os.path.getsize(LANDMARKS_MODEL_PATH)
+        total = sum(proportional_size(worker.pid) for worker in workers)
+        assert total < 2 * model_size
+    finally:
+        done.set()
+        for worker in workers:
+            worker.join(5)
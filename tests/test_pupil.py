@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+import pytest
+
+# The gaze_tracking package imports dlib
+pytest.importorskip("dlib")
+
+from gaze_tracking.pupil import Pupil
+from gaze_tracking.calibration import Calibration
+
+
+def eye_crop(rng, iris=True):
+    """Returns a synthetic eye crop masked like Eye._isolate does: a noisy
+    sclera inside the polygon of the eye landmarks, with a dark iris, and
+    white pixels outside of the eye"""
+    width = int(rng.integers(40, 60))
+    height = int(rng.integers(20, 30))
+    margin = 5
+    crop = rng.normal(150, 12, (height, width)).clip(0, 255).astype(np.uint8)
+
+    # Six landmarks around the eye, like points 36 to 41
+    left, right = margin, width - margin
+    top, bottom = margin, height - margin
+    region = np.array([
+        (left, height // 2),
+        (left + (right - left) // 3, top + int(rng.integers(0, 3))),
+        (left + 2 * (right - left) // 3, top + int(rng.integers(0, 3))),
+        (right, height // 2),
+        (left + 2 * (right - left) // 3, bottom - int(rng.integers(0, 3))),
+        (left + (right - left) // 3, bottom - int(rng.integers(0, 3))),
+    ], np.int32)
+
+    eye = np.zeros_like(crop)
+    cv2.fillPoly(eye, [region], 255)
+    sclera = rng.normal(200, 10, crop.shape).clip(0, 255).astype(np.uint8)
+    crop[eye > 0] = sclera[eye > 0]
+
+    if iris:
+        radius = int(rng.integers(4, 8))
+        center = (int(rng.integers(left + radius, right - radius)), int(rng.integers(top + 2, bottom - 2)))
+        disc = np.zeros_like(crop)
+        cv2.circle(disc, center, radius, 255, -1)
+        disc &= eye
+        dark = rng.normal(40, 8, crop.shape).clip(0, 255).astype(np.uint8)
+        crop[disc > 0] = dark[disc > 0]
+
+    mask = np.full_like(crop, 255)
+    cv2.fillPoly(mask, [region], 0)
+    return cv2.bitwise_or(crop, mask)
+
+
+def locate(crop, threshold):
+    """Returns the pupil positions found by both engines"""
+    contours = Pupil(crop, threshold, Pupil.CONTOURS)
+    components = Pupil(crop, threshold, Pupil.COMPONENTS)
+    return (contours.x, contours.y), (components.x, components.y)
+
+
+def test_engines_agree_on_eye_crops():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        crop = eye_crop(rng)
+        contours, components = locate(crop, Calibration.find_best_threshold(crop))
+        assert (contours[0] is None) == (components[0] is None)
+        if contours[0] is not None:
+            assert abs(contours[0] - components[0]) <= 1
+            assert abs(contours[1] - components[1]) <= 1
+
+
+def test_engines_agree_without_iris():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        # Nothing is darker than the threshold: no iris for both engines
+        contours, components = locate(eye_crop(rng, iris=False), 20)
+        assert contours == (None, None)
+        assert components == (None, None)
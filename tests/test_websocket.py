@@ -0,0 +1,56 @@
+import asyncio
+import struct
+import pytest
+
+# The streaming package imports gaze_tracking, which imports dlib
+pytest.importorskip("dlib")
+
+from streaming.websocket import WebSocket, OPCODE_BINARY, OPCODE_CLOSE, OPCODE_PING, STATUS_TOO_BIG
+
+
+class Writer(object):
+    """Collects what the WebSocket writes"""
+
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+
+def client_frame(opcode, payload, length=None):
+    """Returns a masked frame of the client, announcing the given length"""
+    length = len(payload) if length is None else length
+    mask = b"\x01\x02\x03\x04"
+    masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return struct.pack(">BBQ", 0x80 | opcode, 0x80 | 127, length) + mask + masked
+
+
+def listen(data):
+    """Runs the listener of a WebSocket on the frames of the client"""
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        socket = WebSocket(reader, Writer())
+        await asyncio.wait_for(socket.listen(), 5)
+        return socket
+    return asyncio.run(run())
+
+
+def test_acknowledgements_are_counted():
+    socket = listen(client_frame(OPCODE_BINARY, b"ack!") * 3)
+    assert socket.received == 3
+    assert socket.closed.is_set()
+
+
+@pytest.mark.parametrize("opcode, length", [(OPCODE_BINARY, 1 << 62), (OPCODE_BINARY, 1025), (OPCODE_PING, 126)])
+def test_frames_too_large_drop_the_connection(opcode, length):
+    socket = listen(client_frame(opcode, b"", length))
+    assert socket.received == 0
+    assert socket.writer.data == struct.pack(">BBH", 0x80 | OPCODE_CLOSE, 2, STATUS_TOO_BIG)
+    assert socket.writer.closed
@@ -15,7 +15,10 @@ def main():
     try:
         while True:
             frame_data, _ = udp_socket.recvfrom(buffer_size)
-            frame = np.frombuffer(frame_data, dtype=np.uint8)
+            if len(frame_data) < 4:
+                continue
+            # Skip the sequence number sent before the JPEG frame
+            frame = np.frombuffer(frame_data, dtype=np.uint8, offset=4)
             frame = cv2.imdecode(frame, flags=cv2.IMREAD_COLOR)
 
             if frame is not None:
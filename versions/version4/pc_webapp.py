@@ -1,22 +1,29 @@
 from flask import Flask, Response, render_template_string
 import cv2
 import socket
+import json
+import struct
 import numpy as np
 from threading import Thread
-from threading import Lock
+from threading import Condition
 import time
 
 app = Flask(__name__)
 
-# Global frame variable and lock
+# Global frame variable and lock, notified on every new frame
 latest_frame = None
-frame_lock = Lock()
+latest_count = 0
+latest_timestamp = None
+frame_lock = Condition()
 
-frame_rate = 60
-frame_interval = 1.0 / frame_rate
+# Quality and scale of the stream of pi_stream.py, adjusted to the rate
+# of frames received
+from streaming.quality import QualityController
+stream_quality = QualityController(target_fps=25)
+feedback_interval = 1.0
 
 def udp_listener():
-    global latest_frame
+    global latest_frame, latest_count, latest_timestamp
 
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     host_ip = '0.0.0.0'
@@ -25,55 +32,103 @@ def udp_listener():
     udp_socket.bind((host_ip, host_port))
     print(f"Listening for video stream on UDP {host_ip}:{host_port}")
 
+    received = 0
+    first_sequence = None
+    last_feedback = time.monotonic()
     while True:
-        frame_data, _ = udp_socket.recvfrom(buffer_size)
-        frame = np.frombuffer(frame_data, dtype=np.uint8)
+        frame_data, sender = udp_socket.recvfrom(buffer_size)
+        if len(frame_data) < 4:
+            continue
+        sequence = struct.unpack(">I", frame_data[:4])[0]
+        if first_sequence is None:
+            first_sequence = sequence
+        received += 1
+
+        frame = np.frombuffer(frame_data, dtype=np.uint8, offset=4)
         frame = cv2.imdecode(frame, flags=cv2.IMREAD_COLOR)
         if frame is not None:
+            # Lighter streams have a lower resolution
+            frame = cv2.resize(frame, (640, 480))
             with frame_lock:
                 latest_frame = frame
+                latest_count += 1
+                latest_timestamp = time.monotonic()
+                frame_lock.notify_all()
+
+        # Compare the frames received with the frames sent, and send the level to use back
+        now = time.monotonic()
+        if now - last_feedback >= feedback_interval:
+            elapsed = now - last_feedback
+            offered = ((sequence - first_sequence) & 0xFFFFFFFF) / elapsed
+            stream_quality.update(offered, received / elapsed, now)
+            quality, scale = stream_quality.level
+            udp_socket.sendto(json.dumps({"quality": quality, "scale": scale}).encode(), sender)
+            received = 0
+            first_sequence = sequence
+            last_feedback = now
         time.sleep(0.001)
 
 def generate_frames():
-    global latest_frame
-    last_time = time.time()
-    while True:
-        current_time = time.time()
-        elapsed = current_time - last_time
-        
-        if elapsed < frame_interval:
-            time.sleep(frame_interval - elapsed)
-
-        last_time = current_time
-
-        with frame_lock:
-            if latest_frame is not None:
-                latest_frame = process_frame(latest_frame)
-                video_frame = cv2.imencode('.jpg', latest_frame)[1].tobytes()
-                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + video_frame + b'\r\n')
+    subscription = pipeline.subscribe()
+    try:
+        while True:
+            encoded = subscription.get(timeout=1.0)
+            if encoded is not None:
+                yield encoded.multipart()
+    finally:
+        pipeline.unsubscribe(subscription)
 
 from gaze_tracking import GazeTracking
 gaze = GazeTracking()
 
-def process_frame(frame):
+def detect_gaze(packet):
     
+    packet.text = None
     try:
-        gaze.refresh(frame)
-        frame = gaze.annotated_frame()
+        result = gaze.refresh(packet.frame)
+        packet.frame = gaze.annotated_frame()
         text = ""
-        if gaze.is_blinking():
+        if result.is_blinking:
             text = "Blinking"
-        elif gaze.is_right():
+        elif result.is_right:
             text = "Looking right"
-        elif gaze.is_left():
+        elif result.is_left:
             text = "Looking left"
-        elif gaze.is_center():
+        elif result.is_center:
             text = "Looking center"
-        cv2.putText(frame, text, (90, 60), cv2.FONT_HERSHEY_DUPLEX, 1.6, (147, 58, 31), 2)
+        packet.text = text
     except Exception as e:
         print(e)
 
-    return frame
+    return packet
+
+def render_frame(packet):
+
+    frame = packet.frame
+    if packet.text is not None:
+        cv2.putText(frame, packet.text, (90, 60), cv2.FONT_HERSHEY_DUPLEX, 1.6, (147, 58, 31), 2)
+
+    # Encoded by the encode stage, 95 is the default quality of cv2.imencode
+    return EncodedFrame(packet.sequence, packet.timestamp, None, frame, 95)
+
+# Processes every new frame once for all the clients. Capture, detection,
+# rendering and encoding run on their own workers
+from streaming import Broadcaster, EncodedFrame, Pipeline, Stage, Packet
+last_processed = 0
+def capture_frame():
+    global last_processed
+    with frame_lock:
+        if not frame_lock.wait_for(lambda: latest_count > last_processed, timeout=1.0):
+            return None
+        last_processed = latest_count
+        return Packet(latest_count, latest_timestamp, latest_frame)
+
+processing = Pipeline([Stage("capture", capture_frame),
+                       Stage("detect", detect_gaze),
+                       Stage("render", render_frame),
+                       Stage("encode", EncodedFrame.encode, workers=2)],
+                      queue_size=1)
+pipeline = Broadcaster(processing.get, queue_size=2)
 
 
 @app.route('/')
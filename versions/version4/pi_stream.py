@@ -1,19 +1,48 @@
 import cv2
+import json
 import socket
+import struct
 
 cap = cv2.VideoCapture(0)
 # cap.set(cv2.CAP_PROP_FRAME_WIDTH, 680)
 # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
 
 udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+udp.setblocking(False)
 addr = ('10.0.0.185', 3000)
 
+# Adjusted by pc_webapp.py to the rate it receives
 jpeg_quality = 80
+scale = 1.0
+
+# Each datagram starts with the sequence number of the frame, so the
+# receiver can tell the frames lost on the way
+sequence = 0
+
+def read_feedback():
+    global jpeg_quality, scale
+    while True:
+        try:
+            data, _ = udp.recvfrom(1024)
+        except BlockingIOError:
+            return
+        try:
+            level = json.loads(data)
+            jpeg_quality = int(level["quality"])
+            scale = float(level["scale"])
+        except (ValueError, KeyError, TypeError):
+            pass
 
 while True:
+    read_feedback()
     ret, frame = cap.read()
     if ret:
-        frame = cv2.resize(frame, (640, 480))
+        frame = cv2.resize(frame, (int(640 * scale), int(480 * scale)))
         ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
         if ret:
-            udp.sendto(jpeg.tobytes(), addr)
\ No newline at end of file
+            sequence += 1
+            try:
+                udp.sendto(struct.pack(">I", sequence & 0xFFFFFFFF) + jpeg.tobytes(), addr)
+            except OSError:
+                # Frame too large for a datagram, or send buffer full: it is lost
+                pass